@@ -2,74 +2,338 @@ import os
 import cv2
 import numpy as np
 import time
+import random
 import subprocess
 import re
-import base64
 import argparse
 import shutil
-from PIL import Image, ImageEnhance
+import tempfile
+import threading
+import queue
+import mmap
+import ctypes
+import itertools
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from gradio_client import Client, handle_file
 
+# pybase64 (SIMD decoder) is a drop-in replacement for the stdlib module; use it when installed.
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
 # Import the external API call function
 from dsk_api_vl2sm import dsk_api_vl2sm
-from dsk_api_janus import dsk_api_janus
+from dsk_api_janus import dsk_api_janus, dsk_api_janus_batch
 
 # Retrieve the Hugging Face API token from the environment
 HF_TOKEN = os.getenv("HF_TOKEN")
 
+# Hugging Face Spaces behind each --model option.
+MODELS = {
+    "janus": "deepseek-ai/Janus-Pro-7B",
+    "vl2sm": "deepseek-ai/deepseek-vl2-small",
+}
+
+# Positive answers, matched case-insensitively without lowercasing a copy of the answer.
+_YES_RE = re.compile(r'yes', re.IGNORECASE)
+
+# Visual grounding tags and the base64 payload they carry.
+_IMG_RE = re.compile(r'<img.*?>')
+_B64_RE = re.compile(r'data:image/[^;]+;base64,([^"]+)')
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by all workers: allows `rps` API calls per second on
+    average, with bursts of up to max(1, rps) calls. A non-positive rps disables the limit.
+    """
+    def __init__(self, rps):
+        self.rps = rps
+        self.capacity = max(1.0, rps)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rps <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rps)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rps
+            time.sleep(wait)
+
+# Rate limit on API calls, replaced with the --rps setting (unlimited until then).
+API_BUCKET = TokenBucket(0)
+
+class RunLog:
+    """
+    Append-only handle on log.txt, kept open for the whole run and shared by the worker threads.
+    Writes are serialized and flushed every `flush_every` lines (and on close), so a crash
+    loses at most that many results, which are then simply reprocessed on resume.
+
+    Every file that gets a line in the log is also appended to processed.txt, one name per line,
+    so resuming a run does not have to parse the whole log.
+    """
+    def __init__(self, path, flush_every=16):
+        self.path = path
+        self.processed_path = os.path.join(os.path.dirname(path), "processed.txt")
+        self.flush_every = flush_every
+        self._file = open(path, "a", buffering=1 << 16)
+        self._processed_file = open(self.processed_path, "a", buffering=1 << 16)
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def write(self, text):
+        with self._lock:
+            self._file.write(text)
+            self._count_line()
+
+    def record(self, file_name, text):
+        """
+        Logs the outcome of one file as "file_name: text" and marks it as processed.
+        """
+        with self._lock:
+            self._file.write(f"{file_name}: {text}\n")
+            self._processed_file.write(file_name + "\n")
+            self._count_line()
+
+    def _count_line(self):
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self._file.flush()
+            self._processed_file.flush()
+            self._pending = 0
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._processed_file.close()
+
+# Result lines of log.txt, "filename.jpg: <result>".
+_LOGGED_FILE_RE = re.compile(rb'(?mi)^([^\n:]+\.jpg):')
+
+def load_processed_files(log_file_path):
+    """
+    Returns the set of file names that already have a line in the log.
+
+    Reads processed.txt when it exists. Otherwise (logs from older runs) the log itself is
+    scanned through mmap and processed.txt is written from it, so the next resume is fast.
+    """
+    processed_path = os.path.join(os.path.dirname(log_file_path), "processed.txt")
+    if os.path.exists(processed_path):
+        with open(processed_path, "r") as f:
+            return set(f.read().splitlines())
+
+    processed_files = set()
+    if os.path.getsize(log_file_path) > 0:
+        with open(log_file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for m in _LOGGED_FILE_RE.finditer(mm):
+                processed_files.add(m.group(1).decode().strip())
+    with open(processed_path, "w") as f:
+        f.writelines(file_name + "\n" for file_name in sorted(processed_files))
+    return processed_files
+
+# One Gradio client per worker thread: the vl2sm endpoints keep conversation
+# state per session, so concurrent calls must not share a client.
+_CLIENTS = threading.local()
+
+def get_client(model_used):
+    """
+    Returns the Gradio client of the calling thread, creating it on first use.
+    """
+    client = getattr(_CLIENTS, "client", None)
+    if client is None:
+        client = Client(model_used, hf_token=HF_TOKEN)
+        _CLIENTS.client = client
+    return client
+
+# Preprocessed images only live until they are uploaded. gradio_client's handle_file
+# uploads from a path, not from bytes, so they still go through the filesystem, but a
+# RAM-backed /dev/shm is used when available. Each run gets a folder of its own, removed
+# when it ends, so that runs over other camera folders never see its files.
+# With --debug they are kept in the script's "temp" folder instead.
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else os.getcwd()
+DEBUG_TEMP_FOLDER = os.path.join(SCRIPT_DIR, "temp")
+SHM_FOLDER = "/dev/shm" if os.path.isdir("/dev/shm") else None
+TEMP_FOLDER = DEBUG_TEMP_FOLDER
+KEEP_TEMP = False
+
+def make_run_temp_folder():
+    """Creates the temp folder of this run (in /dev/shm when available) and returns its path."""
+    return tempfile.mkdtemp(prefix="tiny-ghosts-", dir=SHM_FOLDER)
+
+def discard_preprocessed(temp_file_path):
+    """
+    Removes a preprocessed image once its result has been handled, unless temp files are kept.
+    """
+    if KEEP_TEMP:
+        return
+    for path in (temp_file_path, temp_file_path + ".max"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+# With --fast_dilate, diameters of 5 and more use a square instead of a disk: OpenCV runs
+# rectangular dilations as a horizontal then a vertical 1-D pass, O(k) instead of O(k^2)
+# per pixel. Flashes are small round blobs, so the detection is essentially unchanged.
+FAST_DILATE = False
+
+# Structuring elements, keyed by (kernel diameter, shape).
+_KERNEL_CACHE = {}
+
+def get_kernel(kernel_diameter):
+    """
+    Returns the structuring element for the given diameter, built once:
+    disk-shaped, or square with FAST_DILATE for diameters of 5 and more.
+    """
+    shape = cv2.MORPH_RECT if FAST_DILATE and kernel_diameter >= 5 else cv2.MORPH_ELLIPSE
+    key = (kernel_diameter, shape)
+    kernel = _KERNEL_CACHE.get(key)
+    if kernel is None:
+        kernel = cv2.getStructuringElement(shape, (kernel_diameter, kernel_diameter))
+        _KERNEL_CACHE[key] = kernel
+    return kernel
+
+# Contrast lookup tables, keyed by (contrast factor, mean grey level).
+_LUT_CACHE = {}
+
+def get_contrast_lut(contrast_factor, mean):
+    """
+    Returns the 256-entry table mapping x to mean + factor * (x - mean), clipped and truncated
+    to uint8 like PIL's ImageEnhance.Contrast (a blend with the mean grey level).
+    """
+    key = (contrast_factor, mean)
+    lut = _LUT_CACHE.get(key)
+    if lut is None:
+        lut = np.clip(mean + contrast_factor * (np.arange(256, dtype=np.float32) - mean), 0, 255).astype(np.uint8)
+        _LUT_CACHE[key] = lut
+    return lut
+
+# Frames whose brightest pixel is below SKIP_THRESHOLD cannot show a flash; they are logged
+# as skipped without calling the API (set with --skip_threshold, 0 disables the filter).
+SKIP_THRESHOLD = 0
+
+# Long runs fragment the glibc heap with large image buffers; hand freed memory back to the
+# OS every TRIM_EVERY preprocessed images (no-op where malloc_trim is unavailable, e.g. macOS).
+TRIM_EVERY = 100
+_PREPROCESSED_COUNT = itertools.count(1)
+try:
+    _malloc_trim = ctypes.CDLL("libc.so.6").malloc_trim
+except (OSError, AttributeError):
+    _malloc_trim = None
+
 def preprocess_image(file_path, kernel_diameter, contrast_factor):
     """
     Opens the image, crops the bottom 160 pixels (if possible),
     applies dilation with a disk-shaped structuring element (with given kernel diameter),
     and enhances the contrast.
     
-    The processed file is saved to a "temp" folder in the script's directory,
-    with '_processed' appended to the original filename.
+    The processed file is encoded in memory and written once to TEMP_FOLDER, named after
+    the original file plus a digest of its absolute path, kernel diameter, contrast factor
+    and FAST_DILATE, with '_processed' appended. The brightest pixel of the cropped frame is
+    kept in a '.max' sidecar. If both already exist and are newer than the original, the file
+    is reused as is, still subject to SKIP_THRESHOLD.
     
     Returns:
-      str: The path to the saved preprocessed image.
+      str: The path to the saved preprocessed image, or None if the image is darker
+      than SKIP_THRESHOLD and should not be sent to the API.
     """
-    # Open the image
-    img = Image.open(file_path).convert("RGB")
+    # Prepare the temp folder path
+    os.makedirs(TEMP_FOLDER, exist_ok=True)
+    
+    # Build the new filename with '_processed' appended. Trail camera names (DSCF0001...)
+    # repeat across cameras and sites, so the name also depends on where the file comes from
+    # and on the enhancement settings.
+    base_name = os.path.basename(file_path)
+    name, ext = os.path.splitext(base_name)
+    digest = hashlib.blake2b(
+        f"{os.path.abspath(file_path)}|{kernel_diameter}|{contrast_factor}|{FAST_DILATE}".encode(),
+        digest_size=8).hexdigest()
+    new_filename = f"{name}_{digest}_processed{ext}"
+    temp_file_path = os.path.join(TEMP_FOLDER, new_filename)
+    max_file_path = temp_file_path + ".max"
+    
+    # Reuse the processed image left by a previous (--debug) run, with the dark-frame check
+    # on its recorded brightest pixel
+    try:
+        if min(os.path.getmtime(temp_file_path), os.path.getmtime(max_file_path)) >= os.path.getmtime(file_path):
+            with open(max_file_path) as f:
+                brightest = int(f.read())
+            if SKIP_THRESHOLD > 0 and brightest < SKIP_THRESHOLD:
+                return None
+            return temp_file_path
+    except (OSError, ValueError):
+        pass
+    
+    # Open the image (OpenCV loads it as BGR, which is kept all the way to the saved file)
+    img_np = cv2.imread(file_path, cv2.IMREAD_COLOR)
+    if img_np is None:
+        raise ValueError(f"Could not read image {file_path}")
     
     # Crop the image
     bottom_banner_height = 160
-    width, height = img.size
-    if height > bottom_banner_height:
-        img = img.crop((0, 0, width, height - bottom_banner_height))
+    if img_np.shape[0] > bottom_banner_height:
+        img_np = np.ascontiguousarray(img_np[:-bottom_banner_height])
     
-    # Convert to NumPy array for dilation
-    img_np = np.array(img)
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_diameter, kernel_diameter))
-    dilated_np = cv2.dilate(img_np, kernel)
-    img = Image.fromarray(dilated_np)
+    # Cheap pre-filter: dilation does not change the brightest value, so check it right away
+    brightest = int(img_np.max())
+    if SKIP_THRESHOLD > 0 and brightest < SKIP_THRESHOLD:
+        return None
     
-    # Enhance the contrast using ImageEnhance
-    enhancer = ImageEnhance.Contrast(img)
-    img = enhancer.enhance(contrast_factor)
+    # Dilate in place with the cached structuring element
+    cv2.dilate(img_np, get_kernel(kernel_diameter), dst=img_np)
     
-    # Prepare the temp folder path
-    script_dir = os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else os.getcwd()
-    temp_folder = os.path.join(script_dir, "temp")
-    os.makedirs(temp_folder, exist_ok=True)
+    # Enhance the contrast the way PIL's ImageEnhance.Contrast does, with a lookup table
+    # centred on the mean grey level, applied in place
+    # (the grey mean is taken from the per-channel means, without allocating a grey image)
+    mean_b, mean_g, mean_r, _ = cv2.mean(img_np)
+    mean = int(0.299 * mean_r + 0.587 * mean_g + 0.114 * mean_b + 0.5)
+    cv2.LUT(img_np, get_contrast_lut(contrast_factor, mean), dst=img_np)
     
-    # Build the new filename with '_processed' appended
-    base_name = os.path.basename(file_path)
-    name, ext = os.path.splitext(base_name)
-    new_filename = f"{name}_processed{ext}"
-    temp_file_path = os.path.join(temp_folder, new_filename)
-    
-    # Save the processed image
-    img.save(temp_file_path)
+    # Encode the processed image (same JPEG quality as PIL's default) and write it in one go
+    ok, buf = cv2.imencode(".jpg", img_np, [cv2.IMWRITE_JPEG_QUALITY, 75])
+    del img_np
+    if not ok:
+        raise ValueError(f"Could not encode image {file_path}")
+    # Written under a temporary name and renamed, so a crash never leaves a truncated file to reuse
+    # (the sidecar goes last, so a processed image without it is never reused)
+    partial_file_path = temp_file_path + ".part"
+    with open(partial_file_path, "wb") as f:
+        f.write(buf.tobytes())
+    os.replace(partial_file_path, temp_file_path)
+    with open(partial_file_path, "w") as f:
+        f.write(str(brightest))
+    os.replace(partial_file_path, max_file_path)
+    del buf
+    if _malloc_trim is not None and next(_PREPROCESSED_COUNT) % TRIM_EVERY == 0:
+        _malloc_trim(0)
     return temp_file_path
 
-def process_predict_result_janus(predict_result, file_name, original_file_path, output_folder, log_file_path):
+def _fast_copy(src, dst):
+    """
+    Hardlinks src to dst, which costs no data I/O, and falls back to a full copy
+    when they are on different filesystems (or links are not supported, or dst exists).
+    """
+    try:
+        os.link(src, dst)
+    except (OSError, NotImplementedError):
+        shutil.copy2(src, dst)
+
+def process_predict_result_janus(predict_result, file_name, original_file_path, output_folder, run_log):
     """
     Processes the response from the Janus model's API.
     
     This function performs the following:
       - Prints the result for the given file.
-      - Logs the result to a specified log file.
+      - Logs the result to the run log.
       - If the result (as a string) contains "yes" (case-insensitive), it copies the original image
         to the output folder.
     
@@ -78,18 +342,16 @@ def process_predict_result_janus(predict_result, file_name, original_file_path,
         file_name (str): The name of the processed file.
         original_file_path (str): The full path of the original image.
         output_folder (str): The directory where the image should be copied if positive.
-        log_file_path (str): The path to the log file.
+        run_log (RunLog): The log of the current run.
     """
     print(f"Result for {file_name}: {predict_result}")
-
-    with open(log_file_path, "a") as log_file:
-        log_file.write(f"{file_name}: {predict_result}\n")
+    run_log.record(file_name, predict_result)
     
-    if isinstance(predict_result, str) and "yes" in predict_result.lower():
+    if isinstance(predict_result, str) and _YES_RE.search(predict_result):
         dest_file_path = os.path.join(output_folder, file_name)
-        shutil.copy2(original_file_path, dest_file_path)
+        _fast_copy(original_file_path, dest_file_path)
 
-def process_predict_result_vl2sm(predict_result, file_name, original_file_path, output_folder, log_file_path):
+def process_predict_result_vl2sm(predict_result, file_name, original_file_path, output_folder, run_log):
     """
     Process the predict_result from the API:
       - Extract the text portion (everything before the first <img> tag).
@@ -114,93 +376,268 @@ def process_predict_result_vl2sm(predict_result, file_name, original_file_path,
         full_answer = ""
     
     # Extract only the text portion (before any <img> tag)
-    answer_text = re.split(r'<img.*?>', full_answer)[0]
+    img_match = _IMG_RE.search(full_answer)
+    has_img = img_match is not None
+    answer_text = full_answer[:img_match.start()] if has_img else full_answer
     
     # Log and print the answer text.
-    with open(log_file_path, "a") as log_file:
-        log_file.write(f"{file_name}: {answer_text}\n")
+    run_log.record(file_name, answer_text)
     print(f"{file_name}: {answer_text}")
     
     # If the extracted text contains "yes" or an <img> tag is found, copy the original image.
-    if "yes" in answer_text.lower() or re.search(r'<img.*?>', full_answer):
-        shutil.copy2(original_file_path, os.path.join(output_folder, file_name))
+    if has_img or _YES_RE.search(answer_text):
+        _fast_copy(original_file_path, os.path.join(output_folder, file_name))
     
     # If there is an <img> tag, extract and save the visual grounding image.
-    if re.search(r'<img.*?>', full_answer):
+    if has_img:
         save_extracted_image(full_answer, output_folder, file_name)
 
-def save_extracted_image(answer_str, output_folder, file_name):
-    """
-    Look for a base64-encoded image in the answer (inside an <img> tag)
-    and save it as a file in the 'vg' subfolder inside the output folder.
-    """
-    # Use regex to capture the base64 portion inside the <img> tag.
-    match = re.search(r'data:image/[^;]+;base64,([^"]+)', answer_str)
-    if match:
+# Visual grounding images are decoded and written by a background thread,
+# so the workers can move on to their next API call right away.
+_IO_Q = queue.Queue(maxsize=64)
+
+def _writer_loop():
+    while True:
+        b64_payload, dest_file_path = _IO_Q.get()
         try:
-            img_bytes = base64.b64decode(match.group(1))
-            vg_folder = os.path.join(output_folder, "vg")
-            os.makedirs(vg_folder, exist_ok=True)
-            dest_file_path = os.path.join(vg_folder, file_name)
+            img_bytes = base64.b64decode(b64_payload, validate=False)
             with open(dest_file_path, "wb") as f:
                 f.write(img_bytes)
             print(f"Extracted image saved as {dest_file_path}")
-            return True
         except Exception as e:
             print(f"Error decoding base64 image: {e}")
-    else:
-        print("No base64 image found in the answer.")
+        finally:
+            _IO_Q.task_done()
+
+threading.Thread(target=_writer_loop, daemon=True).start()
+
+def save_extracted_image(answer_str, output_folder, file_name):
+    """
+    Look for a base64-encoded image in the answer (inside an <img> tag)
+    and queue it to be saved as a file in the 'vg' subfolder inside the output folder.
+    Call _IO_Q.join() before exiting to make sure every queued image is written.
+    """
+    # Use regex to capture the base64 portion inside the <img> tag.
+    match = _B64_RE.search(answer_str)
+    if match:
+        vg_folder = os.path.join(output_folder, "vg")
+        os.makedirs(vg_folder, exist_ok=True)
+        _IO_Q.put((match.group(1), os.path.join(vg_folder, file_name)))
+        return True
+    print("No base64 image found in the answer.")
     return False
 
+# API call and result handler for each --model option.
+_DISPATCH = {
+    "janus": (dsk_api_janus, process_predict_result_janus),
+    "vl2sm": (dsk_api_vl2sm, process_predict_result_vl2sm),
+}
+
 def resolve_previous_errors(args, prompt_question):
+    global TEMP_FOLDER
     log_file_path = os.path.join(args.output, "log.txt")
     if os.path.exists(log_file_path):
         with open(log_file_path, "r") as log_file:
-            lines = log_file.readlines()
             error_files = []
-            for line in lines:
-                match = re.match(r"^(\d{8}T\d+_DSCF\d+\.JPG):\s+Error", line)
-                if match:
-                    error_files.append(match.group(1).strip())
+            for line in log_file:
+                # Error lines look like "20230702T2130_DSCF0001.JPG: Error - ..."
+                if "Error" not in line:
+                    continue
+                name, _, rest = line.partition(":")
+                if rest.lstrip().startswith("Error") and name.endswith(".JPG") and "T" in name:
+                    error_files.append(name.strip())
 
         if error_files:
-            with open(log_file_path, "a") as log_file:
-                log_file.write("\nReprocessing previously failed files...\n")
-                log_file.write("=" * 50 + "\n")
-
-            for file_name in error_files:
-                date_folder = file_name.split("T")[0]
-                original_file_path = os.path.join(args.input, date_folder, file_name)
-                try:
-                    preprocessed_file_path = preprocess_image(original_file_path, args.kernel_diameter, args.contrast_factor)
-                    print(f"Reprocessing {preprocessed_file_path}...")
-
-                    client = Client("deepseek-ai/Janus-Pro-7B", hf_token=HF_TOKEN)
-
-                    if args.model == "vl2sm":
-                        predict_result = dsk_api_vl2sm(prompt_question, preprocessed_file_path, client)
-                        process_predict_result_vl2sm(predict_result, file_name, original_file_path, args.output, log_file_path)
-                    elif args.model == "janus":
-                        predict_result = dsk_api_janus(prompt_question, preprocessed_file_path, client)
-                        process_predict_result_janus(predict_result, file_name, original_file_path, args.output, log_file_path)
-
-                except Exception as e:
-                    print(f"Retry failed for {file_name}: {e}")
-                    with open(log_file_path, "a") as log_file:
-                        log_file.write(f"{file_name}: Retry Error - {e}\n")
+            # One client for all retried files, for the model the errors came from.
+            client = get_client(MODELS[args.model])
+            api_fn, post_fn = _DISPATCH[args.model]
+            run_log = RunLog(log_file_path)
+            run_log.write("\nReprocessing previously failed files...\n")
+            run_log.write("=" * 50 + "\n")
+            if not KEEP_TEMP:
+                TEMP_FOLDER = make_run_temp_folder()
+
+            try:
+                for file_name in error_files:
+                    date_folder = file_name.split("T")[0]
+                    original_file_path = os.path.join(args.input, date_folder, file_name)
+                    try:
+                        preprocessed_file_path = preprocess_image(original_file_path, args.kernel_diameter, args.contrast_factor)
+                        if preprocessed_file_path is None:
+                            _record_skipped(file_name, run_log)
+                            continue
+                        print(f"Reprocessing {preprocessed_file_path}...")
+
+                        API_BUCKET.acquire()
+                        predict_result = api_fn(prompt_question, preprocessed_file_path, client)
+                        post_fn(predict_result, file_name, original_file_path, args.output, run_log)
+
+                        discard_preprocessed(preprocessed_file_path)
+
+                    except Exception as e:
+                        print(f"Retry failed for {file_name}: {e}")
+                        run_log.record(file_name, f"Retry Error - {e}")
+            finally:
+                _IO_Q.join()
+                run_log.close()
+                if not KEEP_TEMP:
+                    shutil.rmtree(TEMP_FOLDER, ignore_errors=True)
         else:
             print("No error files found to retry.")
     else:
         print(f"No log.txt found in {args.output}. Cannot resolve errors.")
 
-def main(input_folder, output_folder, model_option, kernel_diameter, contrast_factor, prompt_question):
-    # Set model_used based on the provided model option.
-    if model_option == "janus":
-        model_used = "deepseek-ai/Janus-Pro-7B"
-    elif model_option == "vl2sm":
-        model_used = "deepseek-ai/deepseek-vl2-small"
+# ZeroGPU quota errors end with the time left until the quota resets, e.g. "Try again in 0:24:19".
+_RETRY_IN_RE = re.compile(r'try again in (\d+):(\d{2}):(\d{2})', re.IGNORECASE)
+
+def _sleep_for_quota(err_msg, attempt):
+    """
+    Sleeps until the GPU quota should be available again: the reset time from the error
+    message when there is one, otherwise an exponential backoff with jitter
+    (60 s doubling per attempt, capped at 30 min).
+    """
+    m = _RETRY_IN_RE.search(err_msg)
+    if m:
+        hours, minutes, seconds = (int(g) for g in m.groups())
+        delay = hours * 3600 + minutes * 60 + seconds + random.uniform(1, 10)
     else:
+        delay = min(1800, 60 * 2 ** attempt) + random.uniform(0, 30)
+    print(f"GPU quota exceeded. Sleeping for {delay:.0f} s before retrying...")
+    print(time.strftime('%Y-%m-%d %H:%M:%S'))
+    time.sleep(delay)
+
+def _record_skipped(file_name, run_log):
+    print(f"{file_name}: skipped (dark)")
+    run_log.record(file_name, "Skipped - dark")
+
+def _preprocess_ahead(file_names, input_folder, kernel_diameter, contrast_factor, preproc_q):
+    """
+    Producer thread: preprocesses the files in order and queues
+    (file_name, preprocessed_file_path, error) tuples, then a final None.
+    The path is None for images skipped as too dark.
+    The queue's maxsize bounds how far it runs ahead of the API calls.
+    """
+    for file_name in file_names:
+        try:
+            preprocessed_file_path = preprocess_image(os.path.join(input_folder, file_name), kernel_diameter, contrast_factor)
+            preproc_q.put((file_name, preprocessed_file_path, None))
+        except Exception as e:
+            preproc_q.put((file_name, None, e))
+    preproc_q.put(None)
+
+def _process_one(file_name, input_folder, output_folder, model_option, model_used,
+                 kernel_diameter, contrast_factor, prompt_question, run_log, preprocessed_file_path=None):
+    """
+    Sends one image to the API and handles the result, preprocessing it first
+    unless preprocessed_file_path is given. Runs on a worker thread.
+
+    Returns:
+      tuple: (file_name, None) on success, (file_name, exception) on failure.
+    """
+    original_file_path = os.path.join(input_folder, file_name)
+    try:
+        # Preprocess the image.
+        if preprocessed_file_path is None:
+            preprocessed_file_path = preprocess_image(original_file_path, kernel_diameter, contrast_factor)
+            if preprocessed_file_path is None:
+                _record_skipped(file_name, run_log)
+                return file_name, None
+        print(preprocessed_file_path)
+        client = get_client(model_used)
+        api_fn, post_fn = _DISPATCH[model_option]
+        # Retry loop for handling API errors, up to 10 attempts.
+        retry_count = 0
+        success = False
+        while not success and retry_count < 10:
+            try:
+                API_BUCKET.acquire()
+                # Call the model's API and process its result.
+                predict_result = api_fn(prompt_question, preprocessed_file_path, client)
+                post_fn(predict_result, file_name, original_file_path, output_folder, run_log)
+                success = True  # API call succeeded.
+            except Exception as e:
+                retry_count += 1
+                err_msg = str(e)
+                if "exceeded your Pro GPU quota" in err_msg:
+                    _sleep_for_quota(err_msg, retry_count - 1)
+                else:
+                    print(f"Error on attempt {retry_count} for {file_name}: {e}")
+                    time.sleep(2)
+                    if retry_count >= 10:
+                        raise
+        if not success:
+            raise Exception(f"Failed after 10 retries for file {file_name}")
+    except Exception as e:
+        return file_name, e
+    finally:
+        if preprocessed_file_path is not None:
+            discard_preprocessed(preprocessed_file_path)
+    return file_name, None
+
+def _process_batch(file_names, input_folder, output_folder, model_used,
+                   kernel_diameter, contrast_factor, prompt_question, run_log):
+    """
+    Preprocesses a batch of images and sends them to the Janus API together.
+    Files whose call fails fall back to _process_one and its retry loop (all of them
+    if the batch could not be submitted).
+    Runs on a worker thread.
+
+    Returns:
+      list: One (file_name, None or exception) tuple per file.
+    """
+    outcomes = []
+    # (file_name, original_file_path) of the images actually sent, aligned with preprocessed_file_paths
+    sent = []
+    preprocessed_file_paths = []
+    try:
+        for file_name in file_names:
+            original_file_path = os.path.join(input_folder, file_name)
+            preprocessed_file_path = preprocess_image(original_file_path, kernel_diameter, contrast_factor)
+            if preprocessed_file_path is None:
+                _record_skipped(file_name, run_log)
+                outcomes.append((file_name, None))
+                continue
+            sent.append((file_name, original_file_path))
+            preprocessed_file_paths.append(preprocessed_file_path)
+        if not preprocessed_file_paths:
+            return outcomes
+        for _ in preprocessed_file_paths:
+            API_BUCKET.acquire()
+        batch_outcomes = dsk_api_janus_batch(prompt_question, preprocessed_file_paths, get_client(model_used))
+    except Exception as e:
+        print(f"Batch starting at {file_names[0]} failed ({e}), processing its files one by one...")
+        skipped = {file_name for file_name, _ in outcomes}
+        return outcomes + [
+            _process_one(file_name, input_folder, output_folder, "janus", model_used,
+                         kernel_diameter, contrast_factor, prompt_question, run_log)
+            for file_name in file_names if file_name not in skipped
+        ]
+    finally:
+        for preprocessed_file_path in preprocessed_file_paths:
+            discard_preprocessed(preprocessed_file_path)
+
+    for (file_name, original_file_path), (predict_result, error) in zip(sent, batch_outcomes):
+        if error is not None:
+            # Only this file is sent again; the calls that succeeded are kept
+            print(f"{file_name} failed in its batch ({error}), retrying it on its own...")
+            outcomes.append(_process_one(file_name, input_folder, output_folder, "janus", model_used,
+                                         kernel_diameter, contrast_factor, prompt_question, run_log))
+            continue
+        try:
+            process_predict_result_janus(predict_result, file_name, original_file_path, output_folder, run_log)
+            outcomes.append((file_name, None))
+        except Exception as e:
+            outcomes.append((file_name, e))
+    return outcomes
+
+def main(input_folder, output_folder, model_option, kernel_diameter, contrast_factor, prompt_question, concurrency=4, batch_size=1, rps=2.0):
+    global API_BUCKET, TEMP_FOLDER
+    API_BUCKET = TokenBucket(rps)
+
+    # Set model_used based on the provided model option.
+    if model_option not in MODELS:
         raise ValueError(f"Invalid model option: {model_option}")
+    model_used = MODELS[model_option]
 
     print(f"Using model: {model_used}")
     
@@ -220,13 +657,8 @@ def main(input_folder, output_folder, model_option, kernel_diameter, contrast_fa
             log_file.write("\nRun started at " + time.strftime("%Y-%m-%d %H:%M:%S") + "\n")
             log_file.write(f"Input Folder: {input_folder}\n")
             log_file.write("=" * 50 + "\n")
-        # Read the file to determine which files have been processed already.
-        with open(log_file_path, "r") as log_file:
-            for line in log_file:
-                # Assuming processed lines are in the format: "filename.jpg: <result>"
-                m = re.match(r'^(.+\.jpg):', line, re.IGNORECASE)
-                if m:
-                    processed_files.add(m.group(1).strip())
+        # Determine which files have been processed already.
+        processed_files = load_processed_files(log_file_path)
     else:
         # Create a new log file with header info.
         with open(log_file_path, "w") as log_file:
@@ -239,70 +671,68 @@ def main(input_folder, output_folder, model_option, kernel_diameter, contrast_fa
             #log_file.write(f"Temperature: {temperature}\n")
             log_file.write("Run started at " + time.strftime("%Y-%m-%d %H:%M:%S") + "\n")
             log_file.write("=" * 50 + "\n")
+        # A new log starts a new list of processed files.
+        open(os.path.join(output_folder, "processed.txt"), "w").close()
     
-    # Initialize the Gradio client.
-    client = Client(model_used, hf_token=HF_TOKEN)
-    
-    # # Write header info into the log.
-    # with open(log_file_path, "w") as log_file:
-    #     log_file.write(f"Model: {model_used}\n")
-    #     log_file.write(f"Input Folder: {input_folder}\n")
-    #     log_file.write(f"Prompt: {prompt_question}\n")
-    #     log_file.write(f"Kernel Diameter: {kernel_diameter}\n")
-    #     log_file.write(f"Contrast Factor: {contrast_factor}\n")
-    #     #log_file.write(f"Seed: {seed}\n")
-    #     #log_file.write(f"Temperature: {temperature}\n")
-    #     log_file.write("=" * 50 + "\n")
-    
-    # Process .JPG files in alphabetical order.
-    for file_name in sorted(os.listdir(input_folder))[:]:
-        if file_name.lower().endswith('.jpg'):
-            
-            # Skip file if it's already been processed.
-            if file_name in processed_files:
-                continue
-            
-            original_file_path = os.path.join(input_folder, file_name)
-            # print(f"Processing {original_file_path}...")
-            time.sleep(1)
-            try:
-                # Preprocess the image.
-                preprocessed_file_path = preprocess_image(original_file_path, kernel_diameter, contrast_factor)
-                print(preprocessed_file_path)
-                # Retry loop for handling API errors, up to 5 attempts.
-                retry_count = 0
-                success = False
-                while not success and retry_count < 10:
-                    try:
-                        if model_option == "vl2sm":
-                            # Call the external API function for vl2sm.
-                            predict_result = dsk_api_vl2sm(prompt_question, preprocessed_file_path, client)
-                            # Process the prediction result.
-                            process_predict_result_vl2sm(predict_result, file_name, original_file_path, output_folder, log_file_path)
-                        elif model_option == "janus":
-                            # Call the external API function for Janus.
-                            predict_result = dsk_api_janus(prompt_question, preprocessed_file_path, client) #add client if done with freezing issues, or remove client if persists
-                            # Process the Janus-specific result.
-                            process_predict_result_janus(predict_result, file_name, original_file_path, output_folder, log_file_path)
-                        success = True  # API call succeeded.
-                    except Exception as e:
-                        retry_count += 1
-                        err_msg = str(e)
-                        if "exceeded your Pro GPU quota" in err_msg:
-                            print("GPU quota exceeded. Sleeping for 1 hour before retrying...")
-                            print(time.strftime('%Y-%m-%d %H:%M:%S'))
-                            time.sleep(3600)
-                        else:
-                            print(f"Error on attempt {retry_count} for {file_name}: {e}")
-                            time.sleep(2)
-                            if retry_count >= 10:
-                                raise
-                if not success:
-                    raise Exception(f"Failed after 10 retries for file {file_name}")
-            except Exception as e:
-                print(f"Error processing {file_name}: {e}")
-                with open(log_file_path, "a") as log_file:
-                    log_file.write(f"{file_name}: Error - {e}\n")
+    # Process .JPG files in alphabetical order, keeping up to `concurrency` files in flight.
+    # Already processed files are dropped while scanning, so only pending names get sorted.
+    with os.scandir(input_folder) as entries:
+        file_names = sorted(
+            entry.name for entry in entries
+            if entry.name.lower().endswith('.jpg') and entry.name not in processed_files and entry.is_file()
+        )
+    run_log = RunLog(log_file_path)
+    if not KEEP_TEMP:
+        TEMP_FOLDER = make_run_temp_folder()
+    try:
+        # At most `concurrency` files are submitted and not yet done, so neither the
+        # executor's queue nor the preprocessed images pile up.
+        slots = threading.Semaphore(concurrency)
+
+        # Errors are logged in completion order.
+        def handle_outcome(future):
+            slots.release()
+            outcome = future.result()
+            for file_name, error in (outcome if isinstance(outcome, list) else [outcome]):
+                if error is not None:
+                    print(f"Error processing {file_name}: {error}")
+                    run_log.record(file_name, f"Error - {error}")
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # Janus calls are stateless and can be submitted in batches; vl2sm keeps
+            # per-session state, so its files always go one at a time.
+            if model_option == "janus" and batch_size > 1:
+                for i in range(0, len(file_names), batch_size):
+                    slots.acquire()
+                    executor.submit(_process_batch, file_names[i:i + batch_size], input_folder, output_folder, model_used,
+                                    kernel_diameter, contrast_factor, prompt_question, run_log).add_done_callback(handle_outcome)
+            else:
+                # Preprocessing runs on its own thread, a few files ahead of the API calls,
+                # so the CPU-bound OpenCV work overlaps with the network-bound requests.
+                preproc_q = queue.Queue(maxsize=4)
+                threading.Thread(target=_preprocess_ahead, daemon=True,
+                                 args=(file_names, input_folder, kernel_diameter, contrast_factor, preproc_q)).start()
+                while True:
+                    item = preproc_q.get()
+                    if item is None:
+                        break
+                    file_name, preprocessed_file_path, error = item
+                    if error is not None:
+                        print(f"Error processing {file_name}: {error}")
+                        run_log.record(file_name, f"Error - {error}")
+                        continue
+                    if preprocessed_file_path is None:
+                        _record_skipped(file_name, run_log)
+                        continue
+                    slots.acquire()
+                    executor.submit(_process_one, file_name, input_folder, output_folder, model_option, model_used,
+                                    kernel_diameter, contrast_factor, prompt_question, run_log,
+                                    preprocessed_file_path).add_done_callback(handle_outcome)
+    finally:
+        _IO_Q.join()
+        run_log.close()
+        if not KEEP_TEMP:
+            shutil.rmtree(TEMP_FOLDER, ignore_errors=True)
 
 if __name__ == "__main__":
     # Prevent the system from sleeping.
@@ -319,8 +749,20 @@ if __name__ == "__main__":
         parser.add_argument("--kernel_diameter", "-kd", type=int, default=5, help="Diameter of the morphological kernel. Default is 5. Set to 1 for no dilatation.")
         parser.add_argument("--contrast_factor", "-cf", type=float, default=1.5, help="Contrast enhancement factor. Default is 1.5. Set to 1 for no modification.")
         parser.add_argument("--vg", action="store_true", help="If specified, wrap 'firefly flash' with visual grounding tags.")
+        parser.add_argument("--concurrency", "-c", type=int, default=4, help="Number of files processed in parallel. Default is 4. Set to 1 for serial processing.")
+        parser.add_argument("--batch_size", "-b", type=int, default=1, help="Number of images submitted together to the Janus API. Default is 1 (no batching). Ignored for vl2sm.")
+        parser.add_argument("--fast_dilate", action="store_true", help="Dilate with a square (separable) kernel instead of a disk when the diameter is 5 or more.")
+        parser.add_argument("--skip_threshold", "-st", type=int, default=30, help="Images whose brightest pixel is below this value are logged as skipped without calling the API. Default is 30. Set to 0 to send every image.")
+        parser.add_argument("--rps", type=float, default=2.0, help="Maximum API calls per second, shared by all workers. Default is 2. Set to 0 for no limit.")
+        parser.add_argument("--debug", action="store_true", help="Keep the preprocessed images in the script's temp folder.")
         parser.add_argument("--resolve_errors", action="store_true", help="Retry processing files that previously failed with errors.")
         args = parser.parse_args()
+
+        if args.debug:
+            TEMP_FOLDER = DEBUG_TEMP_FOLDER
+            KEEP_TEMP = True
+        FAST_DILATE = args.fast_dilate
+        SKIP_THRESHOLD = args.skip_threshold
         
         # Define your initial prompt.
         prompt_question = "Answer by yes or no: is there any firefly flash in this image?"
@@ -333,10 +775,11 @@ if __name__ == "__main__":
 
         # Reprocess files with errors
         if args.resolve_errors:
+            API_BUCKET = TokenBucket(args.rps)
             resolve_previous_errors(args,prompt_question)
             exit(0)
 
-        main(args.input, args.output, args.model, args.kernel_diameter, args.contrast_factor, prompt_question)
+        main(args.input, args.output, args.model, args.kernel_diameter, args.contrast_factor, prompt_question, args.concurrency, args.batch_size, args.rps)
     finally:
         caffeinate_process.terminate()
         
@@ -3,7 +3,7 @@
 # This module provides an interface to the deepseek-ai/Janus-Pro-7B model's
 # multimodal understanding API via Gradio. The function dsk_api_janus sends a
 # preprocessed image and a prompt to the model's /multimodal_understanding endpoint.
-# If a Gradio client is not provided, it initializes one using the Hugging Face API token.
+# If a Gradio client is not provided, it reuses one cached per model (created with the Hugging Face API token).
 #
 # Usage as a script:
 #   python dsk_api_janus.py -prompt "Hello!!" -image /path/to/image
@@ -12,14 +12,32 @@
 #   from dsk_api_janus import dsk_api_janus
 #   result = dsk_api_janus("Hello!!", "/path/to/image")
 #   print(result)
+#
+#   from dsk_api_janus import dsk_api_janus_batch
+#   for result, error in dsk_api_janus_batch("Hello!!", ["/path/to/image1", "/path/to/image2"]):
+#       print(error if error is not None else result)
 
 import os
 import argparse
+import threading
 from gradio_client import Client, handle_file
 
 # Retrieve the Hugging Face API token from the environment if needed.
 HF_TOKEN = os.getenv("HF_TOKEN")
 
+# Gradio clients created by this module, keyed by model, so that calls made without
+# a client don't redo the handshake and config fetch every time.
+_CLIENT_CACHE = {}
+_CLIENT_CACHE_LOCK = threading.Lock()
+
+def _get_client(model):
+    with _CLIENT_CACHE_LOCK:
+        client = _CLIENT_CACHE.get(model)
+        if client is None:
+            client = Client(model, hf_token=HF_TOKEN)
+            _CLIENT_CACHE[model] = client
+        return client
+
 def dsk_api_janus(prompt, image_path, client=None):
     """
     Call the deepseek-ai/Janus-Pro-7B model's multimodal understanding API.
@@ -27,14 +45,14 @@ def dsk_api_janus(prompt, image_path, client=None):
     Parameters:
         prompt (str): The question or prompt to send to the model.
         image_path (str): The path to the preprocessed image file.
-        client (Client, optional): An existing Gradio client instance. If None, a new client is created.
+        client (Client, optional): An existing Gradio client instance. If None, a cached client for the model is used.
 
     Returns:
         The prediction result from the model's API.
     """
     model = "deepseek-ai/Janus-Pro-7B"
     if client is None:
-        client = Client(model, hf_token=HF_TOKEN)
+        client = _get_client(model)
 
     # Call the API using the provided parameters.
     result = client.predict(
@@ -47,6 +65,47 @@ def dsk_api_janus(prompt, image_path, client=None):
     )
     return result
 
+def dsk_api_janus_batch(prompt, image_paths, client=None):
+    """
+    Call the multimodal understanding API for several images at once.
+
+    The endpoint only takes one image per call, so every request is submitted
+    before waiting on any of them; the Space then queues them together instead
+    of receiving them one round-trip at a time.
+
+    Parameters:
+        prompt (str): The question or prompt to send to the model.
+        image_paths (list of str): The paths to the preprocessed image files.
+        client (Client, optional): An existing Gradio client instance. If None, a cached client for the model is used.
+
+    Returns:
+        list: One (result, error) tuple per image, in the same order as image_paths:
+        the prediction result and None, or None and the exception raised by that call,
+        so that one failed call does not lose the others.
+    """
+    model = "deepseek-ai/Janus-Pro-7B"
+    if client is None:
+        client = _get_client(model)
+
+    jobs = [
+        client.submit(
+            image=handle_file(image_path),
+            question=prompt,
+            seed=42,
+            top_p=0.95,
+            temperature=0,
+            api_name="/multimodal_understanding"
+        )
+        for image_path in image_paths
+    ]
+    outcomes = []
+    for job in jobs:
+        try:
+            outcomes.append((job.result(), None))
+        except Exception as e:
+            outcomes.append((None, e))
+    return outcomes
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Call the deepseek-ai/Janus-Pro-7B model's multimodal understanding API.")
     parser.add_argument("-prompt", type=str, default="Answer only by yes or no: is there any firefly flash in the image?", help="Prompt text to send to the model.")
@@ -3,7 +3,9 @@
 # This module provides an interface to the deepseek-vl2-small model's API via Gradio.
 # It defines a function, dsk_api_vl2sm, that sends a preprocessed image along with a prompt
 # to the model's /transfer_input and /predict endpoints. If a Gradio client is not provided,
-# the function initializes one using the Hugging Face API token from the environment.
+# the function reuses one cached per model (created with the Hugging Face API token from the
+# environment). The cached client holds the conversation state, so concurrent callers should
+# pass their own client.
 #
 # The function handles potential GPU quota errors by pausing and retrying, and resets the 
 # conversation state after obtaining a prediction. This module can be imported and used 
@@ -18,11 +20,25 @@
 
 import os
 import argparse
+import threading
 from gradio_client import Client, handle_file
 
 # Retrieve the Hugging Face API token from the environment
 HF_TOKEN = os.getenv("HF_TOKEN")
 
+# Gradio clients created by this module, keyed by model, so that calls made without
+# a client don't redo the handshake and config fetch every time.
+_CLIENT_CACHE = {}
+_CLIENT_CACHE_LOCK = threading.Lock()
+
+def _get_client(model):
+    with _CLIENT_CACHE_LOCK:
+        client = _CLIENT_CACHE.get(model)
+        if client is None:
+            client = Client(model, hf_token=HF_TOKEN)
+            _CLIENT_CACHE[model] = client
+        return client
+
 def dsk_api_vl2sm(prompt, image_path, client=None):
     """
     Call the deepseek-vl2-small model's API for a preprocessed image.
@@ -31,7 +47,7 @@ def dsk_api_vl2sm(prompt, image_path, client=None):
         prompt (str): The prompt to send to the model.
         preprocessed_file_path (str): The path to the preprocessed image.
         model (str): The model identifier (e.g., "deepseek-ai/deepseek-vl2-small").
-        client (Client, optional): An existing Gradio client. If None, a new client will be created.
+        client (Client, optional): An existing Gradio client. If None, a cached client for the model is used.
         
     Returns:
         The textual output from the model's /predict endpoint.
@@ -39,9 +55,9 @@ def dsk_api_vl2sm(prompt, image_path, client=None):
     # model
     model = "deepseek-ai/deepseek-vl2-small"
     
-    # Initialize the client if none is provided.
+    # Reuse the cached client if none is provided.
     if client is None:
-        client = Client(model, hf_token=HF_TOKEN)
+        client = _get_client(model)
     
     # Prime the state with /transfer_input.
     transfer_result = client.predict(
@@ -1,33 +1,37 @@
 import matplotlib.pyplot as plt
-import mplcursors
 
 import numpy as np
 
-result_array = np.load('results/xyp_gpt-4.1_r3_p64.npy')
+result_path = 'results/xyp_gpt-4.1_r3_p64.npy'
 
-x_vals = result_array[:, :, 0].flatten()
-y_vals = result_array[:, :, 1].flatten()
-p_vals = result_array[:, :, 2].flatten()
+# The sweep is a regular grid: x along columns, y along rows
+if result_path.endswith('.npz'):
+    # compressed sweep: int16 positions and float16 probabilities
+    with np.load(result_path) as data:
+        xy = data['xy']
+        p = data['p'].astype(np.float32)
+    xs = xy[0, :, 0]
+    ys = xy[:, 0, 1]
+else:
+    # older x, y, p float64 array, memory-mapped: only the slices below are actually read from disk
+    result_array = np.load(result_path, mmap_mode='r')
+    xs = np.array(result_array[0, :, 0])
+    ys = np.array(result_array[:, 0, 1])
+    p = np.array(result_array[:, :, 2])
 
-plt.figure(figsize=(12, 8))
-scatter = plt.scatter(x_vals, y_vals, c=p_vals, cmap='turbo', marker="s")
+# Each cell is centered on its sweep position
+dx = xs[1] - xs[0] if len(xs) > 1 else 1
+dy = ys[1] - ys[0] if len(ys) > 1 else 1
+extent = [xs[0] - dx / 2, xs[-1] + dx / 2, ys[-1] + dy / 2, ys[0] - dy / 2]
 
-# Add interactive cursor to display x, y, and probability on hover
-# cursor = mplcursors.cursor(scatter, hover=True)
-# @cursor.connect("add")
-# def on_add(sel):
-#     i = sel.index
-#     sel.annotation.set_text(
-#         f"x={x_vals[i]:.0f}\ny={y_vals[i]:.0f}\nprob={p_vals[i]:.3f}"
-#     )
-plt.clim(0, 1)
-plt.xlim(0, 1024) 
-plt.ylim(0, 512)
-plt.colorbar(scatter, label="'yes' probability")
+plt.figure(figsize=(12, 8))
+# Hovering shows x, y and the probability in the toolbar
+image = plt.imshow(p, extent=extent, origin='upper', cmap='turbo', vmin=0, vmax=1,
+                   interpolation='nearest', aspect='equal')
+plt.xlim(0, 1024)
+plt.ylim(512, 0)
+plt.colorbar(image, label="'yes' probability")
 plt.title("Probability of 'yes' as a function of flash location")
 plt.xlabel("X")
 plt.ylabel("Y")
-plt.gca().invert_yaxis()
-plt.axis('equal')
 plt.show()
-
@@ -1,29 +1,46 @@
 
 import base64
-from openai import OpenAI
+import asyncio
+import hashlib
+import json
+from openai import AsyncOpenAI
 import math
 
 import numpy as np
 import cv2
-from tqdm import tqdm
+from tqdm.asyncio import tqdm
 import matplotlib.pyplot as plt
 
-# Initialize OpenAI client
-client = OpenAI()
+# Numba is optional: when installed the spot is added in one compiled pass over the region.
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
-def encode_image(image_path):
-    """Encodes the image from a file to a base64 string."""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+# Initialize OpenAI client (async, so that many sweep positions can be in flight at once).
+# Rate limits, timeouts and 5xx errors are retried by the client with exponential backoff,
+# honoring the server's retry-after, so a transient error doesn't zero a grid cell.
+client = AsyncOpenAI(max_retries=6)
 
-def classify_image(image_path, model, detail="high"):
+# Prefix of the data URLs carrying the base64 JPEG images
+JPEG_DATA_URL_PREFIX = "data:image/jpeg;base64,"
+
+# Classification prompt, byte-identical across requests and placed before the image,
+# so all requests share the same prefix
+PROMPT = "Answer only by yes or no: do you see any firefly flashes in this image? (watch very carefully)"
+
+def encode_image(img):
+    """Encodes the image array as JPEG in memory and returns it as a base64 string."""
+    ok, buf = cv2.imencode('.jpg', img)
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return base64.b64encode(buf).decode("ascii")
+
+def chat_request(img, model, detail="high"):
     """
-    Classifies the image using the OpenAI API.
-    Returns the response text and top token probabilities.
+    Builds the chat completions request (as keyword arguments / JSON body) classifying the image.
     """
-    prompt = "Answer only by yes or no: do you see any firefly flashes in this image? (watch very carefully)"
-    
-    base64_image = encode_image(image_path)
+    base64_image = encode_image(img)
     
     seed = 0
     temperature=0
@@ -31,33 +48,42 @@ def classify_image(image_path, model, detail="high"):
     logprobs=True
     top_logprobs=4
 
+    return dict(
+        model=model,
+        seed = seed,
+        temperature=temperature,
+        top_p=top_p,
+        logprobs=logprobs,
+        top_logprobs=top_logprobs,
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": PROMPT
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": JPEG_DATA_URL_PREFIX + base64_image,
+                            "detail": detail
+                            }
+                    }
+                ]
+            }
+        ]
+    )
+
+async def classify_image(img, model, detail="high"):
+    """
+    Classifies the image using the OpenAI API.
+    Returns the response text and top token probabilities.
+    """
+    request = chat_request(img, model, detail)
+
     try:
-        response = client.chat.completions.create(
-            model=model,
-            seed = seed,
-            temperature=temperature,
-            top_p=top_p,
-            logprobs=logprobs,
-            top_logprobs=top_logprobs,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                                "detail": detail
-                                }
-                        }
-                    ]
-                }
-            ]
-        )
+        response = await client.chat.completions.create(**request)
 
         # Extract the response text
         response_text = response.choices[0].message.content.strip().lower()
@@ -77,40 +103,73 @@ def classify_image(image_path, model, detail="high"):
         print(f"OpenAI API error: {e}")
         return "error", []
 
-def add_gaussian_spot(img, x, y, sigma, peak):
+def yes_probability(top_tokens):
+    """Returns the probability of the first 'yes' token among the top tokens (0 if absent)."""
+    for token, probability in top_tokens:
+        clean = token.strip().lower()
+        if 'yes' in clean:
+            return probability
+    return 0.0
+
+def gaussian_kernel(sigma, peak, kernel_radius=16):
     """
-    Add a white Gaussian “spot” to img at position (x,y).
-    img: HxWx3 uint8 array
+    Builds the white Gaussian "spot" added by add_gaussian_spot:
+    a (2*kernel_radius+1) square uint8 kernel with value `peak` at the center.
     sigma: standard deviation of the Gaussian
     peak: maximum value at the center
     """
-    # if want a simple circle instead
-    # cv2.circle(img, (x, y), sigma, (peak, peak, peak), thickness=-1)
-    
-    kernel_radius = 16
     kernel_size = 2*kernel_radius + 1
     c = cv2.getGaussianKernel(kernel_size, sigma)
     cc = c.dot(c.T)
     ccn = cc / np.max(cc)
-    cccc = peak * ccn
+    return (peak * ccn).astype(np.uint8)
 
-    half = kernel_radius
+if njit is not None:
+    @njit(cache=True)
+    def _saturating_add(roi, spot):
+        """roi[y, x, c] = min(roi[y, x, c] + spot[y, x], 255), in place."""
+        for y in range(roi.shape[0]):
+            for x in range(roi.shape[1]):
+                s = spot[y, x]
+                for c in range(roi.shape[2]):
+                    v = roi[y, x, c] + s
+                    roi[y, x, c] = 255 if v > 255 else v
+else:
+    _saturating_add = None
+
+def add_gaussian_spot(img, x, y, kernel):
+    """
+    Add a white Gaussian “spot” to img at position (x,y).
+    img: HxWx3 uint8 array
+    kernel: precomputed spot from gaussian_kernel()
+    Returns the (y0, y1, x0, x1) bounds of the modified region.
+    """
+    # if want a simple circle instead
+    # cv2.circle(img, (x, y), sigma, (peak, peak, peak), thickness=-1)
+    
+    half = kernel.shape[0] // 2
+    img_h, img_w = img.shape[:2]
 
     # region of interest in the image
-    x0, x1 = max(0, x-half), min(w, x+half+1)
-    y0, y1 = max(0, y-half), min(h, y+half+1)
+    x0, x1 = max(0, x-half), min(img_w, x+half+1)
+    y0, y1 = max(0, y-half), min(img_h, y+half+1)
 
     # corresponding region of the kernel
     kx0, kx1 = half - (x - x0), half + (x1 - x)
     ky0, ky1 = half - (y - y0), half + (y1 - y)
 
-    # add (with clipping) to all three channels
-    spot = cccc[ky0:ky1, kx0:kx1].astype(np.uint8)
-    for c in range(3):
-        img[y0:y1, x0:x1, c] = np.clip(
-        img[y0:y1, x0:x1, c].astype(int) + spot.astype(int),
-        0, 255
-    ).astype(np.uint8)
+    # saturating uint8 add to all three channels at once, in place
+    roi = img[y0:y1, x0:x1]
+    if _saturating_add is not None:
+        _saturating_add(roi, kernel[ky0:ky1, kx0:kx1])
+    else:
+        # min(roi, 255 - spot) + spot never overflows
+        spot = kernel[ky0:ky1, kx0:kx1, np.newaxis]
+        np.minimum(roi, 255 - spot, out=roi)
+        roi += spot
+
+    # region that was modified, so the caller can restore just that part
+    return y0, y1, x0, x1
 
 
 # Sweep a white blob over the image and record 'Yes' probability
@@ -127,29 +186,129 @@ result_array = np.zeros((len(ys), len(xs), 3), dtype=float)
 model = "gpt-4.1-mini"
 peak = 64
 sigma = 3
+concurrency = 32  # number of API requests in flight
+use_batch_api = False  # submit the whole sweep as one OpenAI batch (half price, results within 24h)
+# Screening at 'low' detail costs a flat 85 tokens per image instead of the 'high' tiling.
+# With refine_detail set (e.g. "high"), cells whose probability falls in refine_range are re-probed at that detail.
+detail = "low"
+refine_detail = None
+refine_range = (0.2, 0.8)
 
-for iy, y in enumerate(tqdm(ys, desc="Y positions")):
-    for ix, x in enumerate(tqdm(xs, desc="X positions", leave=False)):
-        # create base image
-        img = np.full((h, w, 3), fill_value=fill_value, dtype=np.uint8)
-        # add white circular blob
-        add_gaussian_spot(img, x, y, sigma, peak)
-        # save and classify
-        cv2.imwrite('temp.JPG', img)
-        
-        _, top_tokens = classify_image('temp.JPG', model)
-        # find probability for token 'Yes'
-        yes_prob = 0.0
-        for token, probability in top_tokens:
-            clean = token.strip().lower()
-            if 'yes' in clean:
-                yes_prob = probability
-                break
+# The spot is the same at every position, and a single image buffer is enough:
+# each task builds and encodes its image without yielding to the event loop in between.
+spot_kernel = gaussian_kernel(sigma, peak)
+# Between positions only the previous spot's region is reset to the background.
+img = np.full((h, w, 3), fill_value=fill_value, dtype=np.uint8)
+previous_roi = None
+
+def draw_position(x, y):
+    """Moves the spot of the shared image to (x,y) and returns a hash of the resulting image."""
+    global previous_roi
+    # reset base image where the previous spot was
+    if previous_roi is not None:
+        py0, py1, px0, px1 = previous_roi
+        img[py0:py1, px0:px1] = fill_value
+    # add white circular blob
+    previous_roi = add_gaussian_spot(img, x, y, spot_kernel)
+    return hashlib.blake2b(img.tobytes(), digest_size=16).digest()
+
+# Identical stimuli are only sent once: 'yes' probability futures keyed by a hash of the image.
+# (With a low peak the uint8 spot can vanish entirely, and positions outside the frame all
+# give the bare background.)
+yes_prob_by_image = {}
+
+async def classify_position(sem, ix, iy, x, y):
+    async with sem:
+        key = draw_position(x, y)
+        if key in yes_prob_by_image:
+            yes_prob = await yes_prob_by_image[key]
+        else:
+            future = asyncio.get_running_loop().create_future()
+            yes_prob_by_image[key] = future
+            # classify
+            _, top_tokens = await classify_image(img, model, detail)
+            # find probability for token 'Yes'
+            yes_prob = yes_probability(top_tokens)
+            future.set_result(yes_prob)
         result_array[iy, ix] = [x, y, yes_prob]
+
+async def sweep():
+    sem = asyncio.Semaphore(concurrency)
+    positions = [(ix, iy, x, y) for iy, y in enumerate(ys) for ix, x in enumerate(xs)]
+    await tqdm.gather(*(classify_position(sem, *position) for position in positions), desc="Positions")
+
+async def sweep_batch(poll_interval=60):
+    """
+    Same sweep through the Batch API: one JSONL request per distinct image,
+    uploaded as a single batch, polled until done, then parsed back by custom_id.
+    Positions whose request failed keep a 'yes' probability of 0, as in the live sweep.
+    """
+    request_ids = {}  # image hash -> custom_id
+    positions_by_id = {}  # custom_id -> [(ix, iy, x, y)]
+    lines = []
+    for iy, y in enumerate(ys):
+        for ix, x in enumerate(xs):
+            result_array[iy, ix] = [x, y, 0.0]
+            key = draw_position(x, y)
+            custom_id = request_ids.get(key)
+            if custom_id is None:
+                custom_id = f"{iy}_{ix}"
+                request_ids[key] = custom_id
+                lines.append(json.dumps({
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": chat_request(img, model, detail),
+                }))
+            positions_by_id.setdefault(custom_id, []).append((ix, iy, x, y))
+
+    batch_file = await client.files.create(file=("sweep.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch")
+    batch = await client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+    print(f"Submitted batch {batch.id} ({len(lines)} requests)")
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(poll_interval)
+        batch = await client.batches.retrieve(batch.id)
+        print(f"Batch {batch.id}: {batch.status} {batch.request_counts}")
+    if batch.output_file_id is None:
+        raise RuntimeError(f"Batch {batch.id} ended as {batch.status} without output")
+
+    output = await client.files.content(batch.output_file_id)
+    for line in output.text.splitlines():
+        result = json.loads(line)
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            print(f"OpenAI API error for {result['custom_id']}: {result.get('error') or response}")
+            continue
+        logprobs_content = response["body"]["choices"][0]["logprobs"]["content"]
+        top_tokens = [(top["token"], math.exp(top["logprob"])) for top in logprobs_content[0]["top_logprobs"]]
+        yes_prob = yes_probability(top_tokens)
+        for ix, iy, x, y in positions_by_id[result["custom_id"]]:
+            result_array[iy, ix] = [x, y, yes_prob]
+
+async def refine(sem, ix, iy, x, y):
+    async with sem:
+        draw_position(x, y)
+        _, top_tokens = await classify_image(img, model, refine_detail)
+        result_array[iy, ix, 2] = yes_probability(top_tokens)
+
+async def refine_sweep():
+    """Re-probes the ambiguous cells of the screening pass at refine_detail."""
+    sem = asyncio.Semaphore(concurrency)
+    lo, hi = refine_range
+    ambiguous = [(ix, iy, x, y) for iy, y in enumerate(ys) for ix, x in enumerate(xs)
+                 if lo < result_array[iy, ix, 2] < hi]
+    await tqdm.gather(*(refine(sem, *position) for position in ambiguous), desc=f"Refining at {refine_detail}")
+
+asyncio.run(sweep_batch() if use_batch_api else sweep())
+if refine_detail is not None:
+    asyncio.run(refine_sweep())
         
 # Save the result array to disk
-array_name = f"xyp_{model}_r{sigma}_p{peak}.npy"
-np.save(array_name, result_array)
+# (positions fit in int16 and probabilities in float16, compressed to a fraction of the float64 array)
+array_name = f"xyp_{model}_r{sigma}_p{peak}_{detail}" + (f"+{refine_detail}" if refine_detail else "") + ".npz"
+np.savez_compressed(array_name,
+                    xy=result_array[:, :, :2].astype(np.int16),
+                    p=result_array[:, :, 2].astype(np.float16))
 
 # plot output
 x_vals = result_array[:, :, 0].flatten()
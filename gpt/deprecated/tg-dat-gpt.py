@@ -9,13 +9,14 @@ using the GPT-4o API and saves the results to a CSV file. The input folder and o
 specified via command-line arguments.
 
 Features:
-1. Encodes images as base64 strings and sends them to the GPT-4o API.
+1. Crops each image to its bottom info banner, encodes it as a base64 string and sends it to the GPT-4o API.
 2. Requests the extraction of date, time, and temperature (Celsius and Fahrenheit) from each image.
 3. Saves the extracted information (filename, date, time, and temperature) to a CSV file.
 4. Sorts images alphabetically/numerically for processing.
+5. Sends up to --concurrency requests at a time; rows are still written in sorted order.
 
 Usage:
-  python tg-dat-gpt.py --input_flash_folder <path_to_flash_folder> --output_csv_name <output_csv_name>
+  python tg-dat-gpt.py --input_flash_folder <path_to_flash_folder> --output_csv_name <output_csv_name> [--concurrency 8]
 '''
 
 import os
@@ -23,19 +24,40 @@ import base64
 import csv
 import json
 import argparse
-from openai import OpenAI
-
-# Initialize OpenAI client
-client = OpenAI()
-
-# Function to encode the image
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+import asyncio
+import cv2
+from openai import AsyncOpenAI
+
+# Initialize OpenAI client; rate limits, timeouts and 5xx errors are retried
+# with exponential backoff (honoring retry-after) before a file is given up on
+client = AsyncOpenAI(max_retries=6)
+
+# Prefix of the data URLs carrying the base64 JPEG images
+JPEG_DATA_URL_PREFIX = "data:image/jpeg;base64,"
+
+# Height of the trail camera's info banner (date, time, temperature) at the bottom of each picture
+BANNER_HEIGHT = 160
+
+# Function to crop the image to its info banner and JPEG-encode it in memory;
+# the banner is all the model needs, and is a fraction of the full frame's payload
+def encode_banner(image_path):
+    img = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"Could not read image {image_path}")
+    ok, buf = cv2.imencode(".jpg", img[-BANNER_HEIGHT:], [cv2.IMWRITE_JPEG_QUALITY, 90])
+    if not ok:
+        raise ValueError(f"Could not encode image {image_path}")
+    return buf.tobytes()
+
+# Function to encode the image; the decoding and cropping run on a worker thread so that
+# the event loop keeps serving the other in-flight requests meanwhile
+async def encode_image(image_path):
+    image_bytes = await asyncio.to_thread(encode_banner, image_path)
+    return base64.b64encode(image_bytes).decode("ascii")
 
 # Function to extract date, time, and temperature using OpenAI API with structured output
-def extract_image_data(image_path):
-    base64_image = encode_image(image_path)
+async def extract_image_data(image_path):
+    base64_image = await encode_image(image_path)
 
     payload = {
         "model": "gpt-4o-2024-08-06",
@@ -54,7 +76,7 @@ def extract_image_data(image_path):
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}",
+                            "url": JPEG_DATA_URL_PREFIX + base64_image,
                             "detail": "low"
                         }
                     }
@@ -87,7 +109,7 @@ def extract_image_data(image_path):
     }
 
     try:
-        response = client.chat.completions.create(**payload)
+        response = await client.chat.completions.create(**payload)
         response_data = response.to_dict()
 
         # Extract the structured JSON content from the API response
@@ -113,59 +135,74 @@ def extract_image_data(image_path):
         print(f"Error processing image {image_path}: {e}")
         return None
 
-# Function to append image data to a CSV file
-def append_to_csv(file_path, data):
-    # Check if file exists
-    file_exists = os.path.isfile(file_path)
-
-    with open(file_path, mode='a', newline='') as file:
-        writer = csv.writer(file)
-
-        # Write the header if the file is new
-        if not file_exists:
-            writer.writerow(['Filename', 'Year', 'Month', 'Day', 'Hour', 'Minute', 'Second', 'TemperatureC', 'TemperatureF'])
-
-        # Write the data row
-        writer.writerow(data)
+# Header of the output CSV file
+CSV_HEADER = ['Filename', 'Year', 'Month', 'Day', 'Hour', 'Minute', 'Second', 'TemperatureC', 'TemperatureF']
+
+# Function to append a row of image data to the CSV file, through its open writer
+def append_to_csv(writer, filename, extracted_info):
+    writer.writerow([
+        filename,  # Add filename as the first column
+        extracted_info["year"],
+        extracted_info["month"],
+        extracted_info["day"],
+        extracted_info["hour"],
+        extracted_info["minute"],
+        extracted_info["second"],
+        extracted_info["temperature_celsius"],
+        extracted_info["temperature_fahrenheit"]
+    ])
 
 # Main function to process the folder of images
-def process_images(input_flash_folder, output_csv_name):
+async def process_images(input_flash_folder, output_csv_name, concurrency=8):
     # Ensure the output CSV is in the same folder as the input folder
     output_csv_path = os.path.join(input_flash_folder, output_csv_name)
 
     # Sort files in alphabetical/numerical order
     filenames = sorted([f for f in os.listdir(input_flash_folder) if f.lower().endswith(".jpg")])
 
-    for filename in filenames:
-        image_path = os.path.join(input_flash_folder, filename)
-        print(f"Processing {image_path}...")
+    # Send up to `concurrency` requests at a time
+    sem = asyncio.Semaphore(concurrency)
 
-        # Extract date, time, and temperature from the image
-        extracted_info = extract_image_data(image_path)
-        if extracted_info:
+    async def extract(filename):
+        async with sem:
+            image_path = os.path.join(input_flash_folder, filename)
+            print(f"Processing {image_path}...")
+            return await extract_image_data(image_path)
+
+    # Extract date, time, and temperature from the images, all requests started up front
+    tasks = [asyncio.create_task(extract(filename)) for filename in filenames]
+
+    # Append to CSV file, opened once; each row is written (and flushed) as soon as it and the
+    # ones before it are done, so the rows stay in filename order and an interrupted run keeps them
+    file_exists = os.path.isfile(output_csv_path)
+    with open(output_csv_path, mode='a', newline='') as file:
+        writer = csv.writer(file)
+
+        # Write the header if the file is new
+        if not file_exists:
+            writer.writerow(CSV_HEADER)
+
+        for filename, task in zip(filenames, tasks):
+            image_path = os.path.join(input_flash_folder, filename)
             try:
-                image_data = [
-                    filename,  # Add filename as the first column
-                    extracted_info["year"],
-                    extracted_info["month"],
-                    extracted_info["day"],
-                    extracted_info["hour"],
-                    extracted_info["minute"],
-                    extracted_info["second"],
-                    extracted_info["temperature_celsius"],
-                    extracted_info["temperature_fahrenheit"]
-                ]
-                # Append to CSV file
-                append_to_csv(output_csv_path, image_data)
-            except KeyError:
-                print(f"Failed to parse the structured response: {extracted_info}")
-        else:
-            print(f"Failed to process image: {image_path}")
+                extracted_info = await task
+            except Exception as e:
+                print(f"Error processing image {image_path}: {e}")
+                continue
+            if extracted_info:
+                try:
+                    append_to_csv(writer, filename, extracted_info)
+                    file.flush()
+                except KeyError:
+                    print(f"Failed to parse the structured response: {extracted_info}")
+            else:
+                print(f"Failed to process image: {image_path}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Extract metadata from images in a folder and save to CSV.")
     parser.add_argument("--input_flash_folder", type=str, required=True, help="Path to the input folder containing flash images.")
     parser.add_argument("--output_csv_name", type=str, required=True, help="Name of the output CSV file (e.g., output.csv).")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of API requests in flight (default: 8).")
     args = parser.parse_args()
 
-    process_images(args.input_flash_folder, args.output_csv_name)
+    asyncio.run(process_images(args.input_flash_folder, args.output_csv_name, args.concurrency))
@@ -9,6 +9,8 @@ Features:
 - Saves classification results in JSON and text log files.
 - Organizes images into folders based on classification (e.g., flash, night).
 - Optionally prevents night images from being copied to the output folder.
+- Sends the patches at detail 'low' (85 input tokens each instead of ~765 at 'high').
+- Patches are JPEG-encoded in memory; only positive patches are written to disk.
 
 Usage:
   python script.py --input <input_folder> --output <output_folder> --patch <patch_mode> --model <model_name>
@@ -23,18 +25,15 @@ from PIL import Image
 from openai import OpenAI
 import math
 import subprocess
+import sys
+from io import BytesIO
 
 # Initialize OpenAI client
 client = OpenAI()
 
-# Function to encode the image
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
-
-# Function to classify the image using OpenAI API
-def classify_image(image_path, model="gpt-4o"):
-    base64_image = encode_image(image_path)
+# Function to classify the JPEG-encoded image using OpenAI API
+def classify_image(jpeg_bytes, model="gpt-4o"):
+    base64_image = base64.b64encode(jpeg_bytes).decode("ascii")
 
     try:
         response = client.chat.completions.create(
@@ -53,7 +52,7 @@ def classify_image(image_path, model="gpt-4o"):
                         },
                         {
                             "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
+                            "image_url": {"url": f"data:image/jpeg;base64,{base64_image}", "detail": "low"}
                         }
                     ]
                 }
@@ -80,8 +79,19 @@ def classify_image(image_path, model="gpt-4o"):
         print(f"OpenAI API error: {e}")
         return "error", []
 
-# Function to crop the image based on the --patch argument
-def crop_image(image_path, temp_dir, patch_mode):
+# JPEG settings for the patches; with detail "low" the API looks at a 512x512 thumbnail,
+# so higher qualities would only add upload bytes
+PATCH_JPEG_OPTIONS = {"quality": 75, "optimize": False, "subsampling": 2}
+
+# Function to JPEG-encode a patch in memory
+def encode_patch(patch):
+    buf = BytesIO()
+    patch.save(buf, "JPEG", **PATCH_JPEG_OPTIONS)
+    return buf.getvalue()
+
+# Function to crop the image based on the --patch argument;
+# returns the name and JPEG bytes of each patch
+def crop_image(image_path, patch_mode):
     with Image.open(image_path) as img:
         width, height = img.size
 
@@ -94,10 +104,8 @@ def crop_image(image_path, temp_dir, patch_mode):
         cropped_img = img.crop((0, top_margin, width, height - bottom_margin))
 
         if patch_mode == "1":
-            # Save the full image
-            full_patch_path = os.path.join(temp_dir, "_full-patch.JPG")
-            cropped_img.save(full_patch_path)
-            return [full_patch_path]
+            # Encode the full image
+            return [("_full-patch.JPG", encode_patch(cropped_img))]
 
         elif patch_mode == "2":
             # Resize to 512x1024 and split into two 512x512 patches
@@ -106,13 +114,8 @@ def crop_image(image_path, temp_dir, patch_mode):
             left_patch = resized_img.crop((0, 0, 512, 512))
             right_patch = resized_img.crop((512, 0, 1024, 512))
 
-            left_patch_path = os.path.join(temp_dir, "_left-patch.JPG")
-            right_patch_path = os.path.join(temp_dir, "_right-patch.JPG")
-
-            left_patch.save(left_patch_path)
-            right_patch.save(right_patch_path)
-
-            return [left_patch_path, right_patch_path]
+            return [("_left-patch.JPG", encode_patch(left_patch)),
+                    ("_right-patch.JPG", encode_patch(right_patch))]
 
         elif patch_mode == "4d":
             # Crop the top 640 pixels, keeping only the bottom 640x2560
@@ -122,14 +125,12 @@ def crop_image(image_path, temp_dir, patch_mode):
             resized_img = bottom_cropped_img.resize((2048, 512), Image.LANCZOS)
 
             # Split into four 512x512 patches
-            patch_paths = []
+            patches = []
             for i in range(4):
                 patch = resized_img.crop((i * 512, 0, (i + 1) * 512, 512))
-                patch_path = os.path.join(temp_dir, f"_patch_4_{i}.JPG")
-                patch.save(patch_path)
-                patch_paths.append(patch_path)
+                patches.append((f"_patch_4_{i}.JPG", encode_patch(patch)))
 
-            return patch_paths
+            return patches
         
         elif patch_mode == "4u":
             # Crop the top 640 pixels
@@ -139,28 +140,24 @@ def crop_image(image_path, temp_dir, patch_mode):
             resized_img = top_cropped_img.resize((2048, 512), Image.LANCZOS)
 
             # Split into four 512x512 patches
-            patch_paths = []
+            patches = []
             for i in range(4):
                 patch = resized_img.crop((i * 512, 0, (i + 1) * 512, 512))
-                patch_path = os.path.join(temp_dir, f"_patch_4_{i}.JPG")
-                patch.save(patch_path)
-                patch_paths.append(patch_path)
+                patches.append((f"_patch_4_{i}.JPG", encode_patch(patch)))
 
-            return patch_paths
+            return patches
 
         elif patch_mode == "8":
             # Resize to 1024x2048 and split into eight 512x512 patches
             resized_img = cropped_img.resize((2048, 1024), Image.LANCZOS)
 
-            patch_paths = []
+            patches = []
             for i in range(1, -1, -1):
                 for j in range(4):
                     patch = resized_img.crop((j * 512, i * 512, (j + 1) * 512, (i + 1) * 512))
-                    patch_path = os.path.join(temp_dir, f"_patch_{i}_{j}.JPG")
-                    patch.save(patch_path)
-                    patch_paths.append(patch_path)
+                    patches.append((f"_patch_{i}_{j}.JPG", encode_patch(patch)))
 
-            return patch_paths
+            return patches
 
         else:
             raise ValueError("Invalid patch mode. Must be 1, 2, 4u, 4d, or 8.")
@@ -170,14 +167,12 @@ def process_images(input_folder, output_folder, model, patch_mode, nonight):
     # Create output folders if they don't exist
     flash_folder = os.path.join(output_folder, 'flash')
     night_folder = os.path.join(output_folder, 'night')
-    temp_folder = os.path.join(output_folder, 'temp')
     positive_patches_folder = os.path.join(output_folder, 'positive-patches')
     json_log_path = os.path.join(output_folder, f"results_{os.path.basename(input_folder)}.json")
 
     os.makedirs(flash_folder, exist_ok=True)
     if not nonight:
         os.makedirs(night_folder, exist_ok=True)
-    os.makedirs(temp_folder, exist_ok=True)
     os.makedirs(positive_patches_folder, exist_ok=True)
 
     # Ensure the JSON log file exists
@@ -192,31 +187,34 @@ def process_images(input_folder, output_folder, model, patch_mode, nonight):
     # Open the log file for writing
     with open(log_file_path, "w") as log_file:
         # Get list of JPG files and sort them
-        filenames = sorted([f for f in os.listdir(input_folder) if f.lower().endswith('.jpg') and f.startswith('DSCF')])
+        # (one scandir pass; the file type comes with the directory entry, without a stat per file)
+        with os.scandir(input_folder) as entries:
+            filenames = sorted(e.name for e in entries
+                               if e.name.lower().endswith('.jpg') and e.name.startswith('DSCF') and e.is_file())
 
         # Iterate over sorted list of JPG files
         for filename in filenames:
             image_path = os.path.join(input_folder, filename)
 
             try:
-                # Use the temp folder for patch files
-                patch_paths = crop_image(image_path, temp_folder, patch_mode)
+                # Patches are encoded in memory, no temp files
+                patches = crop_image(image_path, patch_mode)
 
                 destination_folder = night_folder if not nonight else None
                 image_entry = {"image_path": image_path, "patches": []}
 
-                for patch_path in patch_paths:
-                    result, top_token_info = classify_image(patch_path, model=model)
+                for patch_name, jpeg_bytes in patches:
+                    result, top_token_info = classify_image(jpeg_bytes, model=model)
 
                     # Log in text file
-                    log_file.write(f"Image: {image_path}\nPatch: {patch_path}\nOutput: {result}\n")
+                    log_file.write(f"Image: {image_path}\nPatch: {patch_name}\nOutput: {result}\n")
                     print(f"Image: {image_path}")
-                    print(f"Patch: {patch_path}")
+                    print(f"Patch: {patch_name}")
                     print(f"Output: {result}")
 
                     # Build JSON patch entry
                     patch_entry = {
-                        "patch_path": patch_path,
+                        "patch_path": patch_name,
                         "output": result,
                         "tokens": [{"token": token, "probability": probability} for token, probability in top_token_info]
                     }
@@ -233,9 +231,9 @@ def process_images(input_folder, output_folder, model, patch_mode, nonight):
 
                     if 'yes' in result:
                         # Save the positive patch
-                        patch_filename = os.path.basename(patch_path)
-                        positive_patch_path = os.path.join(positive_patches_folder, f"{filename}_{patch_filename}")
-                        shutil.copy(patch_path, positive_patch_path)
+                        positive_patch_path = os.path.join(positive_patches_folder, f"{filename}_{patch_name}")
+                        with open(positive_patch_path, "wb") as patch_file:
+                            patch_file.write(jpeg_bytes)
                         print(f"Saved positive patch: {positive_patch_path}")
 
                         destination_folder = flash_folder
@@ -260,8 +258,18 @@ def process_images(input_folder, output_folder, model, patch_mode, nonight):
                 print(f"Error processing image {image_path}: {e}")
                 log_file.write(f"Image: {image_path}\nError: {e}\n\n")
 
+def prevent_sleep():
+    """
+    Keeps the Mac awake while the script runs (caffeinate, which also exits on its own if the
+    script dies). Returns the caffeinate process, or None on other platforms, where nothing is done.
+    """
+    if sys.platform != "darwin":
+        return None
+    return subprocess.Popen(["caffeinate", "-ims", "-w", str(os.getpid())])
+
 if __name__ == "__main__":
-    caffeinate_process = subprocess.Popen(["caffeinate", "-ims"])  # Start caffeinate
+    # Prevent system sleep (macOS only).
+    caffeinate_process = prevent_sleep()
     try:
         parser = argparse.ArgumentParser(description="Process images for firefly flash detection.")
         parser.add_argument("--input", type=str, required=True, help="Path to the input folder containing images.")
@@ -284,5 +292,6 @@ if __name__ == "__main__":
 
         process_images(args.input, args.output, args.model, args.patch, args.nonight)
     finally:
-        caffeinate_process.terminate()  # Ensure caffeinate is stopped
+        if caffeinate_process is not None:
+            caffeinate_process.terminate()  # Ensure caffeinate is stopped
 
@@ -0,0 +1,43 @@
+'''
+Converts a JSON Lines results log written by tg_gpt_folder.py (one image entry per line)
+into a single JSON document {"images": [...]}, as the script used to write.
+
+Usage:
+  python jsonl_to_json.py --input results_<folder>.jsonl [--output results_<folder>.json]
+'''
+
+import os
+import json
+import argparse
+
+# orjson is optional: when installed it parses and writes the logs several times faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def jsonl_to_json(input_path, output_path):
+    """
+    Reads the image entries of the JSON Lines log and writes them as one indented JSON document.
+    Blank lines are skipped.
+    """
+    loads = orjson.loads if orjson is not None else json.loads
+    with open(input_path, "rb") as jsonl_file:
+        images = [loads(line) for line in jsonl_file if line.strip()]
+
+    if orjson is not None:
+        with open(output_path, "wb") as json_file:
+            json_file.write(orjson.dumps({"images": images}, option=orjson.OPT_INDENT_2))
+    else:
+        with open(output_path, "w") as json_file:
+            json.dump({"images": images}, json_file, indent=4)
+    print(f"Wrote {len(images)} images to {output_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a JSON Lines results log into a single JSON file.")
+    parser.add_argument("--input", "-i", type=str, required=True, help="Path to the .jsonl results log.")
+    parser.add_argument("--output", "-o", type=str, default=None, help="Path to the .json output (default: input with a .json extension).")
+    args = parser.parse_args()
+
+    output_path = args.output or os.path.splitext(args.input)[0] + ".json"
+    jsonl_to_json(args.input, output_path)
@@ -4,8 +4,8 @@ Firefly Flash Detection - Single Image Test Script
 This script allows testing firefly flash detection on a single image.
 It preprocesses the image using a separate module (tg_gpt_preprocess_image.py)
 that crops, enhances, and splits the image into patches (returned as PIL.Image objects).
-Each patch is then temporarily saved and classified using an AI model.
-Classification results and token probabilities are output directly to the console.
+Each patch is then JPEG-encoded in memory and classified using an AI model; the requests for all
+patches are sent at once. Classification results and token probabilities are output directly to the console.
 
 Features:
 - Supports multiple patch modes: full image, two-patch split, bottom crop with resizing, four-patch (top or bottom), or eight-patch split.
@@ -16,34 +16,43 @@ Usage:
   python tg-vis-gpt-test.py --input <image_path> --patch <patch_mode> --model <model_name>
 """
 
-import os
-import base64
 import argparse
+import asyncio
 from PIL import Image
-from openai import OpenAI
+from openai import AsyncOpenAI
 import math
+from io import BytesIO
+
+# Same API as the stdlib base64, SIMD-accelerated when pybase64 is installed
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
 
 # Import the new preprocess_image function from the separate module.
 from tg_gpt_preprocess_image import preprocess_image
 
-# Initialize OpenAI client
-client = OpenAI()
+# Same prompt as tg_gpt_folder.py, so the test results carry over to folder runs
+PROMPT = "Answer only by yes or no: do you see any firefly flashes in this image? (watch very carefully)"
+
+# Initialize OpenAI client; rate limits, timeouts and 5xx errors are retried
+# with exponential backoff (honoring retry-after)
+client = AsyncOpenAI(max_retries=6)
 
-def encode_image(image_path):
+def encode_image(image):
     """
-    Encodes the image from a file to a base64 string.
+    Encodes the image (PIL.Image) to a base64 JPEG string, in memory.
     """
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+    buf = BytesIO()
+    image.save(buf, "JPEG")
+    return base64.b64encode(buf.getbuffer()).decode("ascii")
 
-def classify_image(image_path, model="gpt-4o"):
+async def classify_image(image, model="gpt-4o"):
     """
     Classifies the image using the OpenAI API.
     Returns the response text and top token probabilities.
     """
-    prompt = "Answer only by yes or no: do you see any firefly flashes in this image? (watch very carefully)"
-    
-    base64_image = encode_image(image_path)
+    base64_image = encode_image(image)
     
     detail = "low"
     
@@ -54,7 +63,7 @@ def classify_image(image_path, model="gpt-4o"):
     top_logprobs=2
 
     try:
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model=model,
             temperature=temperature,
             seed=seed,
@@ -71,7 +80,7 @@ def classify_image(image_path, model="gpt-4o"):
                     "content": [
                         {
                             "type": "text",
-                            "text": prompt
+                            "text": PROMPT
                         },
                         {
                             "type": "image_url",
@@ -131,18 +140,16 @@ if __name__ == "__main__":
         contrast_factor=args.contrast_factor
     )
 
-    # Process each patch: save it temporarily, classify it, print the results, and remove the temporary file.
-    for idx, patch in enumerate(patches):
-        temp_patch_path = f"temp_patch_{idx}.jpg"
-        patch.save(temp_patch_path)
+    for patch in patches:
         patch.show()
-        result, top_token_info = classify_image(temp_patch_path, model=args.model)
 
+    # Classify all patches concurrently, then print the results in patch order.
+    async def classify_all():
+        return await asyncio.gather(*(classify_image(patch, model=args.model) for patch in patches))
+
+    for idx, (result, top_token_info) in enumerate(asyncio.run(classify_all())):
         print(f"Patch {idx + 1}:")
         print(f"Output: {result}")
         for token, probability in top_token_info:
             print(f"Token: '{token}', Probability: {probability:.2f}")
-        print("-----------------------------")
-
-        # Remove the temporary patch file
-        os.remove(temp_patch_path)
\ No newline at end of file
+        print("-----------------------------")
\ No newline at end of file
@@ -12,107 +12,449 @@ Key changes:
 
 Features:
 - Supports multiple patch modes: full image, two-patch split, bottom/top crops, or eight-patch split.
-- Saves classification results in both JSON and text log files.
-- Organizes images into 'flash' (copied), 'night' (symlinked), 'temp', and 'positive-patches'.
+- Saves classification results in both JSON Lines (one image per line) and text log files;
+  `jsonl_to_json.py` (or --json, at the end of each folder) turns the former into a single JSON document.
+- Organizes images into 'flash' (hardlinked, or copied across filesystems), 'night' (symlinked),
+  and 'positive-patches'.
+- Patches are JPEG-encoded in memory; only positive patches are written to disk.
+- Byte-identical patches (static scenes) are classified once; results are kept across runs in
+  <output>/patch_cache.json.
+- Preprocesses the images in a process pool (--workers), a few images (--prefetch) ahead of the
+  classification.
+- Classifies up to --concurrency images at a time; the patches of one image are sent together,
+  and the first positive patch cancels the image's remaining requests (logged as 'skipped').
+- Optionally paces requests under the account's rate limits (--rpm, --tpm) instead of waiting
+  out 429 backoffs.
+- Offline runs can go through the Batch API (--batch) at half the price.
+- Optionally gives up on an image's remaining patches when its first ones are confidently
+  negative (--early_exit_conf).
+- Optionally classifies uniformly dark patches as 'dark' locally, without a request (--dark_threshold).
+- Optionally screens the patches at low detail and re-checks at high detail only those whose
+  'yes' probability exceeds a lower threshold (--triage).
 
 Usage:
   python tg_gpt_folder.py --input <input_folder> --output <output_folder> \
          [--model <model_name>] [--patch <patch_mode>] [--kernel_diameter N] \
-         [--contrast_factor F] [--detail <low|high>] [--sensitivity S]
+         [--contrast_factor F] [--detail <low|high> | --triage P] [--sensitivity S | --no_logprobs] [--concurrency N] \
+         [--workers N] [--prefetch N] [--rpm N] [--tpm N] [--batch] [--early_exit_conf C] \
+         [--resample <filter>] [--draft] [--reducing_gap G] [--jpeg_quality Q] [--dark_threshold T] [--multi] [--json]
 '''
 
 import os
 import shutil
-import base64
 import json
 import argparse
+import asyncio
 from PIL import Image
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 import math
 import subprocess
+import sys
 import time
+import hashlib
+import functools
+import contextlib
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+# pybase64 (SIMD encoder) is a drop-in replacement for the stdlib module; use it when installed,
+# the patches being base64-encoded on the event loop thread.
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# orjson is optional: when installed the JSON Lines log, the patch cache and the Batch API files
+# are (de)serialized with it (several times faster than the json module, and straight to bytes).
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dump_json_line(obj):
+    """Serializes obj as one compact JSON line, as bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, separators=(",", ":")) + "\n").encode("utf-8")
+
+def load_json(data):
+    """Parses a JSON document or line (str or bytes)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
 # Import the new preprocess_image function from the separate module.
-from tg_gpt_preprocess_image import preprocess_image
-
-# Initialize OpenAI client
-client = OpenAI()
-
-def encode_image(image_path):
-    """Encodes the image from a file to a base64 string."""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
-
-def classify_image(image_path, model="gpt-4o", detail="high"):
+from tg_gpt_preprocess_image import preprocess_image_jpeg, RESAMPLE_FILTERS
+from jsonl_to_json import jsonl_to_json
+
+# Initialize OpenAI client; rate limits, timeouts and 5xx errors that still get through
+# the rate limiter below are retried with exponential backoff (honoring retry-after).
+# Its HTTP client is shared by the whole run and keeps connections open for a minute between
+# requests (httpx closes idle ones after 5 s), so paced requests don't redo the TCP+TLS handshake;
+# a request stalled for over a minute, or a connection not established within 10 s, is given up on and retried.
+client = AsyncOpenAI(
+    max_retries=6,
+    timeout=httpx.Timeout(60.0, connect=10.0),
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60.0),
+    ),
+)
+
+# Number of patches of an image classified before --early_exit_conf can skip the rest
+EARLY_EXIT_PATCHES = 2
+
+# A patch is dark when its mean grey level is under --dark_threshold and its grey levels vary
+# less than this (standard deviation); a small share of the dark patches is still sent, so that
+# the logs show whether the threshold hides flashes
+DARK_MAX_STD = 3.0
+DARK_QA_RATE = 0.01
+
+# Approximate number of tokens of the text part of a request (prompt and message framing)
+PROMPT_TOKENS = 40
+
+def estimate_tokens(width, height, detail):
     """
-    Classifies the image using the OpenAI API.
-    Returns the response text and top token probabilities.
+    Estimates the input tokens of a request carrying one image of the given size,
+    following OpenAI's image token accounting (85 base tokens, plus 170 per 512px tile
+    once the image is fitted in 2048x2048 and its short side in 768 for high detail).
     """
-    prompt = "Answer only by yes or no: do you see any firefly flashes in this image? (watch very carefully)"
-    
-    base64_image = encode_image(image_path)
+    if detail == "low":
+        return PROMPT_TOKENS + 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return PROMPT_TOKENS + 85 + 170 * tiles
+
+class RateLimiter:
+    """
+    Token-bucket limiter on both requests and tokens per minute.
+    Each request waits until both buckets cover its cost before it is sent, so that the
+    requests go out at the account's pace rather than being rejected and backed off.
+    A limit of 0 disables that bucket.
+    """
+    def __init__(self, rpm=0, tpm=0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.available_requests = float(rpm)
+        self.available_tokens = float(tpm)
+        self.last_update = time.monotonic()
+        self.lock = None
+
+    def refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.last_update = now
+        self.available_requests = min(self.rpm, self.available_requests + elapsed * self.rpm / 60)
+        self.available_tokens = min(self.tpm, self.available_tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens):
+        if not self.rpm and not self.tpm:
+            return
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        # Requests are served one at a time, in arrival order
+        async with self.lock:
+            # A request larger than the whole bucket would never fit; let it through at full capacity
+            tokens = min(tokens, self.tpm)
+            while True:
+                self.refill()
+                missing_requests = max(0.0, 1 - self.available_requests) if self.rpm else 0.0
+                missing_tokens = max(0.0, tokens - self.available_tokens) if self.tpm else 0.0
+                if not missing_requests and not missing_tokens:
+                    break
+                wait = max(missing_requests * 60 / self.rpm if self.rpm else 0.0,
+                           missing_tokens * 60 / self.tpm if self.tpm else 0.0)
+                await asyncio.sleep(wait)
+            if self.rpm:
+                self.available_requests -= 1
+            if self.tpm:
+                self.available_tokens -= tokens
+
+# Shared by all requests of the run; set from --rpm/--tpm
+RATE_LIMITER = RateLimiter()
+
+def patch_key(jpeg_bytes, model, detail, logprobs):
+    """
+    Key of the patch cache: a hash of the encoded patch and of the request settings.
+    A static camera gives many byte-identical patches from one frame to the next.
+    """
+    digest = hashlib.blake2b(f"{model}|{detail}|{logprobs}|".encode("ascii"), digest_size=16)
+    digest.update(jpeg_bytes)
+    return digest.hexdigest()
+
+def load_patch_cache(cache_path):
+    """Loads the patch cache (key -> [response text, top token probabilities]) saved by earlier runs."""
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, "rb") as cache_file:
+            return load_json(cache_file.read())
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable patch cache {cache_path}: {e}")
+        return {}
+
+# Seconds between two saves of the patch cache during a run, so that a crash loses little
+CACHE_SAVE_INTERVAL = 300
+
+def save_patch_cache(cache_path, cache):
+    """Saves the patch cache atomically, so that an interrupted run doesn't leave a truncated file."""
+    temp_path = cache_path + ".part"
+    with open(temp_path, "wb") as cache_file:
+        cache_file.write(dump_json_line(cache))
+    os.replace(temp_path, cache_path)
+
+# Prompt for one patch, and for several patches sent in the same request; the text comes first
+# and is byte-identical across requests, so the request prefix stays the same from one patch to the next
+PROMPT = "Answer only by yes or no: do you see any firefly flashes in this image? (watch very carefully)"
+MULTI_PROMPT = ("There are {n} images. For each image, in order, answer only by yes or no, "
+                "separated by commas: do you see any firefly flashes in the image? (watch very carefully)")
+
+def chat_request(jpeg_bytes, model="gpt-4o", detail="high", logprobs=True):
+    """
+    Builds the chat completions request (as keyword arguments / JSON body) classifying the image.
+    `jpeg_bytes` can also be a list of images, sent in the same message with a prompt asking
+    for one answer per image.
+    Without `logprobs`, the request asks for the answer text only.
+    """
+    images = jpeg_bytes if isinstance(jpeg_bytes, list) else [jpeg_bytes]
+    prompt = PROMPT if len(images) == 1 else MULTI_PROMPT.format(n=len(images))
     
     temperature=0
     top_p=0.1
-    logprobs=True
     top_logprobs=2
 
-    try:
-        response = client.chat.completions.create(
-            model=model,
-            temperature=temperature,
-            top_p=top_p,
-            logprobs=logprobs,
-            top_logprobs=top_logprobs,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                                "detail": detail
-                                }
-                        }
-                    ]
+    content = [
+        {
+            "type": "text",
+            "text": prompt
+        }
+    ]
+    for image in images:
+        base64_image = base64.b64encode(image).decode("ascii")
+        content.append({
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:image/jpeg;base64,{base64_image}",
+                "detail": detail
                 }
-            ]
-        )
+        })
+
+    request = dict(
+        model=model,
+        temperature=temperature,
+        top_p=top_p,
+        messages=[
+            {
+                "role": "user",
+                "content": content
+            }
+        ]
+    )
+    if logprobs:
+        request.update(logprobs=True, top_logprobs=top_logprobs)
+    return request
+
+def parse_response(response):
+    """
+    Extracts the response text and top token probabilities from a chat completion (as a dict,
+    either from the live API or from a Batch API output line).
+    The probabilities are empty when the request did not ask for logprobs.
+    """
+    # Extract the response text
+    response_text = response["choices"][0]["message"]["content"].strip().lower()
 
-        # Extract the response text
-        response_text = response.choices[0].message.content.strip().lower()
+    # Extract token information
+    top_token_info = []
+    if not response["choices"][0].get("logprobs"):
+        return response_text, top_token_info
+    logprobs_content = response["choices"][0]["logprobs"]["content"]
+    for token_logprob in logprobs_content[:1]:
+        for top in token_logprob["top_logprobs"][:2]:
+            token = top["token"]
+            logprob = top["logprob"]
+            probability = math.exp(logprob)  # Convert log probability to probability
+            top_token_info.append((token, probability))
 
-        # Extract token information
-        logprobs_content = response.choices[0].logprobs.content
-        top_token_info = []
-        for token_logprob in logprobs_content[:1]:
-            for top in token_logprob.top_logprobs[:2]:
-                token = top.token
-                logprob = top.logprob
-                probability = math.exp(logprob)  # Convert log probability to probability
-                top_token_info.append((token, probability))
+    return response_text, top_token_info
 
-        return response_text, top_token_info
+def answer_probability(top_token_info, answer="yes"):
+    """Returns the probability of the answer's token (e.g. 'yes' or 'no') among the top tokens (0 if absent)."""
+    return max((probability for token, probability in top_token_info if token.lower() == answer), default=0.0)
+
+async def classify_image(jpeg_bytes, model="gpt-4o", detail="high", logprobs=True):
+    """
+    Classifies the JPEG-encoded image using the OpenAI API.
+    Returns the response text and top token probabilities.
+    """
+    try:
+        response = await client.chat.completions.create(**chat_request(jpeg_bytes, model, detail, logprobs))
+        return parse_response(response.to_dict())
     except Exception as e:
         print(f"OpenAI API error: {e}")
         return "error", []
 
-def process_images(input_folder, output_folder, model, patch_mode, kernel_diameter, contrast_factor, detail, sensitivity, master_input=None):
+def parse_multi_response(response, n):
+    """
+    Splits the answer to a request carrying n patches into one (response text, top token probabilities)
+    per patch, the probabilities being those of the patch's yes/no token.
+    Returns None when the answer does not hold exactly n yes/no answers.
+    """
+    answers = [answer.strip().strip(".").lower()
+               for answer in response["choices"][0]["message"]["content"].split(",")]
+    if len(answers) != n or any(answer not in ("yes", "no") for answer in answers):
+        return None
+    if not response["choices"][0].get("logprobs"):
+        return [(answer, []) for answer in answers]
+
+    # The answer tokens, in order, skipping the separators
+    answer_tokens = [token_logprob for token_logprob in response["choices"][0]["logprobs"]["content"]
+                     if token_logprob["token"].strip().lower() in ("yes", "no")]
+    if len(answer_tokens) != n:
+        return None
+
+    results = []
+    for answer, token_logprob in zip(answers, answer_tokens):
+        top_token_info = [(top["token"].strip(), math.exp(top["logprob"]))
+                          for top in token_logprob["top_logprobs"][:2]]
+        results.append((answer, top_token_info))
+    return results
+
+async def classify_patches(jpeg_list, model="gpt-4o", detail="high", logprobs=True):
+    """
+    Classifies several JPEG-encoded patches in a single request.
+    Returns one (response text, top token probabilities) per patch, or None when the request
+    failed or the answer could not be split per patch.
+    """
+    try:
+        response = await client.chat.completions.create(**chat_request(jpeg_list, model, detail, logprobs))
+        results = parse_multi_response(response.to_dict(), len(jpeg_list))
+        if results is None:
+            print(f"Malformed answer for {len(jpeg_list)} patches: {response.choices[0].message.content!r}")
+        return results
+    except Exception as e:
+        print(f"OpenAI API error: {e}")
+        return None
+
+# The Batch API takes input files of up to 200 MB; larger runs are split into several batches
+BATCH_MAX_BYTES = 190 * 1024 * 1024
+
+async def submit_batch(lines, poll_interval=60):
+    """
+    Uploads the JSONL request lines (bytes, newline-terminated) as one batch, polls until it is done and returns its output lines.
+    The lines of the requests that failed (kept apart in the batch's error file) are returned too.
+    """
+    batch_file = await client.files.create(file=("patches.jsonl", b"".join(lines)), purpose="batch")
+    batch = await client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+    print(f"Submitted batch {batch.id} ({len(lines)} requests)")
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(poll_interval)
+        batch = await client.batches.retrieve(batch.id)
+        print(f"Batch {batch.id}: {batch.status} {batch.request_counts}")
+    output_lines = []
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if file_id is not None:
+            output = await client.files.content(file_id)
+            output_lines.extend(output.text.splitlines())
+    if not output_lines:
+        print(f"Batch {batch.id} ended as {batch.status} without output")
+    return output_lines
+
+async def run_batch(requests, poll_interval=60):
+    """
+    Sends the requests through the Batch API (half the price, no rate limits, results within 24 h):
+    uploads them as JSONL files, polls until the batches are done, then parses the output back.
+
+    Parameters:
+        requests (dict): custom_id -> chat completions request, as built by chat_request.
+        poll_interval (int): Seconds between two status checks.
+
+    Returns:
+        dict: custom_id -> (response text, top token probabilities); failed requests map to ("error", []).
+    """
+    chunks = [[]]
+    chunk_bytes = 0
+    for custom_id, body in requests.items():
+        line = dump_json_line({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": body,
+        })
+        if chunks[-1] and chunk_bytes + len(line) > BATCH_MAX_BYTES:
+            chunks.append([])
+            chunk_bytes = 0
+        chunks[-1].append(line)
+        chunk_bytes += len(line)
+
+    outputs = await asyncio.gather(*(submit_batch(lines, poll_interval) for lines in chunks))
+
+    results = {custom_id: ("error", []) for custom_id in requests}
+    answered = set()
+    for line in (line for output in outputs for line in output):
+        result = load_json(line)
+        answered.add(result["custom_id"])
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            print(f"OpenAI API error for {result['custom_id']}: {result.get('error') or response}")
+            continue
+        results[result["custom_id"]] = parse_response(response["body"])
+    # e.g. requests left unprocessed by an expired or cancelled batch
+    if len(answered) < len(requests):
+        print(f"{len(requests) - len(answered)} batch requests got no answer")
+    return results
+
+def fast_copy(src, dst):
+    """
+    Files a flash image: a hardlink when the output is on the input's filesystem (no bytes copied),
+    otherwise, or when dst already exists, a plain copy as before.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy(src, dst)
+
+def list_jpgs(folder):
+    """
+    Lists the names of the JPG files in the folder, in a single scandir pass
+    (the file type comes with the directory entry, without a stat per file).
+    """
+    with os.scandir(folder) as entries:
+        return [entry.name for entry in entries
+                if entry.name.lower().endswith('.jpg') and entry.is_file()] #and entry.name.startswith('20')]
+
+async def process_images(input_folder, output_folder, model, patch_mode, kernel_diameter, contrast_factor, detail, sensitivity, master_input=None, concurrency=8, use_batch=False, resample="lanczos", draft=False, reducing_gap=None, multi=False, workers=None, prefetch=8, logprobs=True, write_json=False, triage=None, executor=None, filenames=None, jpeg_quality=75, early_exit_conf=None, dark_threshold=0):
     """
     Processes all JPG images in the input folder.
-    For each image, the new preprocess_image function (which returns PIL.Image patches) is called.
-    Each patch is temporarily saved and classified. Results are logged and images are organized
+    For each image, the preprocess_image pipeline (cropping, enhancement, patch split) is run.
+    Each patch is JPEG-encoded in memory and classified. Results are logged and images are organized
     based on the classification output.
+    Up to `concurrency` images are in flight at a time, so that the network round-trips overlap.
+    With `use_batch`, all patches are sent through the Batch API instead and every patch is classified.
+    With `multi`, the patches of an image are sent together in one request, falling back to one
+    request per patch when the answer cannot be split.
+    Without `logprobs`, only the answer text is requested and `sensitivity` has no effect.
+    The images are preprocessed by `workers` processes (default: one per core), up to `prefetch`
+    images ahead of the classification; an `executor` passed in (e.g. shared by several folders)
+    is used instead.
+    The patches are JPEG-encoded at `jpeg_quality`; `reducing_gap` is passed to their resize.
+    With `dark_threshold`, uniformly dark patches (mean grey level below it) are logged as 'dark'
+    without being sent, except for a DARK_QA_RATE sample.
+    With `early_exit_conf`, the first EARLY_EXIT_PATCHES patches of an image are classified first, and the
+    others are skipped when all of them are 'no' with a probability above `early_exit_conf` (per-patch
+    live requests only).
+    `filenames` are the images still to process when the caller has already listed the folders;
+    by default the input folder is listed and the images already in flash/night are skipped.
+    With `write_json`, the JSON Lines log is also converted to a single JSON document once the folder is done.
+    With `triage`, the patches are screened at low detail (whatever `detail` is) and those not positive
+    but with a 'yes' probability above `triage` are classified again at high detail, which decides.
     """
     flash_folder = os.path.join(output_folder, 'flash')
-    temp_folder = os.path.join(output_folder, 'temp')
     positive_patches_folder = os.path.join(output_folder, 'positive-patches')
-    json_log_path = os.path.join(output_folder, f"results_{os.path.basename(input_folder)}.json")
+    json_log_path = os.path.join(output_folder, f"results_{os.path.basename(input_folder)}.jsonl")
+    cache_path = os.path.join(output_folder, "patch_cache.json")
 
     # Determine night-folder, placing subfolder symlinks under output/night/<subfolder>
     if master_input:
@@ -126,14 +468,8 @@ def process_images(input_folder, output_folder, model, patch_mode, kernel_diamet
 
     os.makedirs(flash_folder, exist_ok=True)
     os.makedirs(night_folder, exist_ok=True)
-    os.makedirs(temp_folder, exist_ok=True)
     os.makedirs(positive_patches_folder, exist_ok=True)
 
-    # Initialize the JSON log file if it doesn't exist.
-    if not os.path.exists(json_log_path):
-        with open(json_log_path, "w") as json_file:
-            json.dump({"images": []}, json_file)
-
     input_folder_name = os.path.basename(input_folder)
     log_file_path = os.path.join(output_folder, f"results_{input_folder_name}.txt")
 
@@ -141,87 +477,115 @@ def process_images(input_folder, output_folder, model, patch_mode, kernel_diamet
     with open(log_file_path, "a") as log_file:
         log_file.write("\nRun started at " + time.strftime("%Y-%m-%d %H:%M:%S") + "\n")
         log_file.write(f"Model: {model}\n")
-        log_file.write(f"Detail: {detail}\n")
-        log_file.write(f"Sensitivity: {sensitivity}\n")
+        log_file.write(f"Detail: {detail if triage is None else f'low, high above {triage}'}\n")
+        log_file.write(f"Sensitivity: {sensitivity if logprobs else 'n/a (no logprobs)'}\n")
         log_file.write(f"Kernel Diameter: {kernel_diameter}\n")
         log_file.write(f"Contrast Factor: {contrast_factor}\n")
+        log_file.write(f"Resample: {resample}\n")
+        log_file.write(f"Draft: {draft}\n")
+        log_file.write(f"Reducing Gap: {reducing_gap}\n")
+        log_file.write(f"JPEG Quality: {jpeg_quality}\n")
+        log_file.write(f"Dark Threshold: {dark_threshold}\n")
+        log_file.write(f"Multi: {multi}\n")
+        log_file.write(f"Early Exit Confidence: {early_exit_conf}\n")
         log_file.write("=" * 50 + "\n\n")
 
-    with open(log_file_path, "a") as log_file:
-        # Process JPG files that match the naming pattern.
-        filenames = sorted([f for f in os.listdir(input_folder)
-                            if f.lower().endswith('.jpg') ]) #and f.startswith('20')])
-        # Skip images already processed (in flash or night folders)
-        processed = set()
-        # Images copied to flash
-        for f in os.listdir(flash_folder):
-            processed.add(f)
-        # Images symlinked to night
-        for f in os.listdir(night_folder):
-            processed.add(f)
-        # Only process new images
-        filenames = [f for f in filenames if f not in processed]
-        for filename in filenames:
-            image_path = os.path.join(input_folder, filename)
-            try:
-                # Preprocess the image to obtain patches (returned as PIL.Image objects).
-                patches = preprocess_image(file_path=image_path, patch_mode=patch_mode,
-                                           kernel_diameter=kernel_diameter,
-                                           contrast_factor=contrast_factor)
-                destination_folder = night_folder
-                image_entry = {"image_path": image_path, "patches": []}
-
-                positive_found = False
-                for idx, patch in enumerate(patches):
-                    # Save each patch temporarily in the temp folder.
-                    temp_patch_path = os.path.join(temp_folder, f"temp_patch_{idx}.jpg")
-                    patch.save(temp_patch_path)
-
-                    result, top_token_info = classify_image(temp_patch_path, model=model, detail=detail)
-
-                    log_file.write(f"Image: {image_path}\nPatch: {temp_patch_path}\nOutput: {result}\n")
-                    print(f"Image: {image_path}")
-                    print(f"Patch: {temp_patch_path}")
-                    print(f"Output: {result}")
-
-                    patch_entry = {
-                        "patch_path": temp_patch_path,
-                        "output": result,
-                        "tokens": [{"token": token, "probability": probability} 
-                                   for token, probability in top_token_info]
-                    }
-                    image_entry["patches"].append(patch_entry)
-
-                    for token, probability in top_token_info:
-                        print(f"Token: '{token}', Probability: {probability:.2f}")
-                        log_file.write(f"Token: '{token}', Probability: {probability:.2f}\n")
-                    log_file.write("\n")
-                    print("-----------------------------")
-                    
-                    # Check if any token labeled 'yes' exceeds the sensitivity threshold.
-                    for token, probability in top_token_info:
-                        if token.lower() == "yes" and probability > sensitivity:
-                            positive_found = True
-                            break
-
-                    if 'yes' in result or positive_found:
-                        # If positive, copy the patch to the positive patches folder.
-                        patch_filename = os.path.basename(temp_patch_path)
-                        positive_patch_path = os.path.join(positive_patches_folder, f"{filename}_{patch_filename}")
-                        shutil.copy(temp_patch_path, positive_patch_path)
-                        print(f"Saved positive patch: {positive_patch_path}")
-                        destination_folder = flash_folder
-                        break
-
-                    # Remove the temporary patch file after classification.
-                    os.remove(temp_patch_path)
+    # Both logs are appended to with a large buffer; each image adds one line to the JSON Lines log
+    # instead of rewriting the whole JSON document.
+    # Results of the patches already classified, in this run or earlier ones; byte-identical
+    # patches are not sent again
+    patch_cache = load_patch_cache(cache_path)
+    last_cache_save = time.monotonic()
+
+    # Detail of the first (or only) request for each patch
+    screen_detail = detail if triage is None else "low"
+
+    try:
+        loop = asyncio.get_running_loop()
+        with open(log_file_path, "a", buffering=1 << 16) as log_file, \
+             open(json_log_path, "ab", buffering=1 << 16) as json_file, \
+             (contextlib.nullcontext(executor) if executor is not None
+              else ProcessPoolExecutor(max_workers=workers)) as executor:
+            if filenames is None:
+                # Skip images already processed (in flash or night folders)
+                processed = set()
+                # Images copied to flash
+                processed.update(os.listdir(flash_folder))
+                # Images symlinked to night
+                processed.update(os.listdir(night_folder))
+                # Process only new JPG files, in one pass over the folder
+                filenames = sorted(f for f in list_jpgs(input_folder) if f not in processed)
+
+            def is_positive(result, top_token_info):
+                """Tells whether the answer is yes, or its 'yes' token exceeds the sensitivity threshold."""
+                # The first word of the answer, not any 'yes' inside it (e.g. "no, ... eyes")
+                words = result.split(maxsplit=1)
+                if words and words[0].strip(".,!") == "yes":
+                    return True
+                return answer_probability(top_token_info) > sensitivity
+
+            def log_skipped(image_path, image_entry, patch_name):
+                """
+                Logs a patch whose request was cancelled after another patch of the image came back positive,
+                or that was not sent after a confident early exit.
+                """
+                log_file.write(f"Image: {image_path}\nPatch: {patch_name}\nOutput: skipped\n\n")
+                image_entry["patches"].append({"patch_path": patch_name, "output": "skipped", "tokens": []})
+
+            async def classify_patch(jpeg_bytes, size, detail=screen_detail):
+                key = patch_key(jpeg_bytes, model, detail, logprobs)
+                if key in patch_cache:
+                    return tuple(patch_cache[key])
+                await RATE_LIMITER.acquire(estimate_tokens(*size, detail))
+                result = await classify_image(jpeg_bytes, model=model, detail=detail, logprobs=logprobs)
+                if result[0] != "error":
+                    patch_cache[key] = result
+                return result
+
+            def needs_recheck(result, top_token_info):
+                """Tells whether a screened patch is doubtful enough to be classified again at high detail."""
+                return (triage is not None and result != "error" and not is_positive(result, top_token_info)
+                        and answer_probability(top_token_info) > triage)
+
+            async def triage_patch(jpeg_bytes, size):
+                result = await classify_patch(jpeg_bytes, size)
+                if needs_recheck(*result):
+                    result = await classify_patch(jpeg_bytes, size, detail="high")
+                return result
+
+            def log_patch(image_path, image_entry, patch_name, jpeg_bytes, result, top_token_info):
+                """Logs one patch result and tells whether the patch is positive."""
+                # The patch's lines are written to the log and the console in one call each
+                # (a line-buffered console is flushed once, not once per line)
+                text = f"Image: {image_path}\nPatch: {patch_name}\nOutput: {result}\n" + "".join(
+                    f"Token: '{token}', Probability: {probability:.2f}\n" for token, probability in top_token_info)
+                log_file.write(text + "\n")
+                print(text + "-----------------------------")
+
+                patch_entry = {
+                    "patch_path": patch_name,
+                    "output": result,
+                    "tokens": [{"token": token, "probability": probability} 
+                               for token, probability in top_token_info]
+                }
+                image_entry["patches"].append(patch_entry)
+
+                if is_positive(result, top_token_info):
+                    # If positive, save the patch to the positive patches folder.
+                    positive_patch_path = os.path.join(positive_patches_folder, f"{os.path.basename(image_path)}_{patch_name}")
+                    with open(positive_patch_path, "wb") as patch_file:
+                        patch_file.write(jpeg_bytes)
+                    print(f"Saved positive patch: {positive_patch_path}")
+                    return True
+                return False
+
+            def save_image_entry(image_path, image_entry, destination_folder):
+                """Appends the image entry to the JSON log and files the original image."""
+                nonlocal last_cache_save
+                filename = os.path.basename(image_path)
 
                 # Append image entry to JSON log.
-                with open(json_log_path, "r+") as json_file:
-                    data = json.load(json_file)
-                    data["images"].append(image_entry)
-                    json_file.seek(0)
-                    json.dump(data, json_file, indent=4)
+                json_file.write(dump_json_line(image_entry))
 
                 # Copy or symlink the original image to the appropriate folder based on classification.
                 try:
@@ -232,25 +596,276 @@ def process_images(input_folder, output_folder, model, patch_mode, kernel_diamet
                             os.symlink(os.path.abspath(image_path), symlink_path)
                         print(f"Symlinked {filename} to {destination_folder}")
                     else:
-                        shutil.copy(image_path, destination_folder)
+                        fast_copy(image_path, os.path.join(destination_folder, filename))
                         print(f"Copied {filename} to {destination_folder}")
                 except Exception as e:
                     print(f"Error copying/symlinking image {filename}: {e}")
                     log_file.write(f"Image: {image_path}\nError copying/symlinking file: {e}\n\n")
-            except Exception as e:
-                print(f"Error processing image {image_path}: {e}")
-                log_file.write(f"Image: {image_path}\nError: {e}\n\n")
 
-    # Clean up temp folder when done
-    try:
-        shutil.rmtree(temp_folder)
-        print(f"Removed temp folder: {temp_folder}")
-    except Exception as e:
-        print(f"Error removing temp folder {temp_folder}: {e}")
+                # Checkpoint the cache now and then; the finally clause below does not run if the process is killed
+                if time.monotonic() - last_cache_save > CACHE_SAVE_INTERVAL:
+                    save_patch_cache(cache_path, patch_cache)
+                    last_cache_save = time.monotonic()
+
+            def is_dark(luma):
+                """Tells whether a patch is dark enough to be classified without a request."""
+                mean, std = luma
+                return (mean < dark_threshold and std < DARK_MAX_STD
+                        and random.random() >= DARK_QA_RATE)
+
+            async def load_patches(filename):
+                """
+                Preprocesses the image; returns the name, JPEG bytes and size of each of its patches,
+                and which of them are dark.
+                """
+                image_path = os.path.join(input_folder, filename)
+                # The preprocessing (decode, dilation, resize, encode) runs in the process pool,
+                # so that it uses all cores while the requests are in flight.
+                encoded = await loop.run_in_executor(executor, functools.partial(
+                    preprocess_image_jpeg, image_path, patch_mode=patch_mode,
+                    kernel_diameter=kernel_diameter, contrast_factor=contrast_factor,
+                    resample=resample, draft=draft, reducing_gap=reducing_gap,
+                    quality=jpeg_quality))
+                # Positive patches are saved as <image>_<patch name>, e.g. DSCF0133.JPG_patch_1.jpg
+                patches = [(f"patch_{idx}.jpg", jpeg_bytes, size)
+                           for idx, (jpeg_bytes, size, _) in enumerate(encoded)]
+                return patches, [is_dark(luma) for _, _, luma in encoded]
+
+            async def process_one(filename, patches_task):
+                image_path = os.path.join(input_folder, filename)
+                try:
+                    patches, dark = await patches_task
+                    destination_folder = night_folder
+                    image_entry = {"image_path": image_path, "patches": []}
+
+                    # Dark patches are settled without a request; the others are sent
+                    results = [("dark", []) if patch_dark else None for patch_dark in dark]
+                    to_send = [idx for idx, patch_dark in enumerate(dark) if not patch_dark]
+
+                    multi_results = None
+                    if multi and len(to_send) > 1:
+                        await RATE_LIMITER.acquire(sum(estimate_tokens(*patches[idx][2], screen_detail) for idx in to_send))
+                        multi_results = await classify_patches([patches[idx][1] for idx in to_send],
+                                                               model=model, detail=screen_detail, logprobs=logprobs)
+                    if multi_results is not None:
+                        for idx, result in zip(to_send, multi_results):
+                            results[idx] = result
+                        # Doubtful patches are re-checked one by one
+                        recheck = [idx for idx in to_send if needs_recheck(*results[idx])]
+                        rechecked = await asyncio.gather(*(classify_patch(*patches[idx][1:], detail="high")
+                                                           for idx in recheck))
+                        for idx, result in zip(recheck, rechecked):
+                            results[idx] = result
+                        to_send = []
+
+                    # Send all patches at once; as soon as one comes back positive, the image is a flash
+                    # and the requests still pending are cancelled.
+                    # With an early exit, the first patches go first and the others only follow
+                    # if those are not all confidently negative.
+                    tasks = {}
+                    def send(indices):
+                        sent = set()
+                        for idx in indices:
+                            _, jpeg_bytes, size = patches[idx]
+                            task = asyncio.ensure_future(triage_patch(jpeg_bytes, size))
+                            tasks[task] = idx
+                            sent.add(task)
+                        return sent
+
+                    first, rest = to_send, []
+                    if early_exit_conf is not None and len(to_send) > EARLY_EXIT_PATCHES:
+                        first, rest = to_send[:EARLY_EXIT_PATCHES], to_send[EARLY_EXIT_PATCHES:]
+                    pending = send(first)
+                    try:
+                        while pending:
+                            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                            for task in done:
+                                results[tasks[task]] = task.result()
+                            if any(is_positive(*results[tasks[task]]) for task in done):
+                                break
+                            if not pending and rest:
+                                if all(answer_probability(results[idx][1], "no") > early_exit_conf for idx in first):
+                                    break
+                                pending, rest = send(rest), []
+                    finally:
+                        for task in pending:
+                            task.cancel()
+
+                    # Log the patches in order
+                    for (patch_name, jpeg_bytes, _), patch_result in zip(patches, results):
+                        if patch_result is None:
+                            log_skipped(image_path, image_entry, patch_name)
+                        elif log_patch(image_path, image_entry, patch_name, jpeg_bytes, *patch_result):
+                            destination_folder = flash_folder
+
+                    save_image_entry(image_path, image_entry, destination_folder)
+                except Exception as e:
+                    print(f"Error processing image {image_path}: {e}")
+                    log_file.write(f"Image: {image_path}\nError: {e}\n\n")
+
+            async def process_batch():
+                # Preprocess every image first; each patch becomes one request of the batch
+                image_patches = {}
+                requests = {}
+                request_ids = {}  # patch key -> custom_id of the one request sent for it
+                loaded = await asyncio.gather(*(load_patches(filename) for filename in filenames), return_exceptions=True)
+                for filename, image_loaded in zip(filenames, loaded):
+                    if isinstance(image_loaded, Exception):
+                        e = image_loaded
+                        image_path = os.path.join(input_folder, filename)
+                        print(f"Error processing image {image_path}: {e}")
+                        log_file.write(f"Image: {image_path}\nError: {e}\n\n")
+                        continue
+                    patches, dark = image_patches[filename] = image_loaded
+                    for idx, (_, jpeg_bytes, _) in enumerate(patches):
+                        # Dark, cached and duplicate patches are not sent
+                        if dark[idx]:
+                            continue
+                        key = patch_key(jpeg_bytes, model, detail, logprobs)
+                        if key in patch_cache or key in request_ids:
+                            continue
+                        request_ids[key] = f"{filename}|{idx}"
+                        requests[request_ids[key]] = chat_request(jpeg_bytes, model=model, detail=detail, logprobs=logprobs)
+
+                results = await run_batch(requests) if requests else {}
+                for key, custom_id in request_ids.items():
+                    if results[custom_id][0] != "error":
+                        patch_cache[key] = results[custom_id]
+
+                # Route the images as in the live mode; all their patches have been classified
+                for filename, (patches, dark) in image_patches.items():
+                    image_path = os.path.join(input_folder, filename)
+                    try:
+                        destination_folder = night_folder
+                        image_entry = {"image_path": image_path, "patches": []}
+                        for (patch_name, jpeg_bytes, _), patch_dark in zip(patches, dark):
+                            if patch_dark:
+                                result, top_token_info = "dark", []
+                            else:
+                                key = patch_key(jpeg_bytes, model, detail, logprobs)
+                                result, top_token_info = patch_cache.get(key) or results[request_ids[key]]
+                            if log_patch(image_path, image_entry, patch_name, jpeg_bytes, result, top_token_info):
+                                destination_folder = flash_folder
+                        save_image_entry(image_path, image_entry, destination_folder)
+                    except Exception as e:
+                        print(f"Error processing image {image_path}: {e}")
+                        log_file.write(f"Image: {image_path}\nError: {e}\n\n")
+
+            async def produce(queue):
+                # Start preprocessing the images in order; the bounded queue keeps it at most
+                # `prefetch` images ahead of the classifiers.
+                for filename in filenames:
+                    await queue.put((filename, asyncio.ensure_future(load_patches(filename))))
+                for _ in range(concurrency):
+                    await queue.put(None)
+
+            async def consume(queue):
+                while (item := await queue.get()) is not None:
+                    await process_one(*item)
+
+            if use_batch:
+                await process_batch()
+            else:
+                # Keep up to `concurrency` images in classification at a time
+                queue = asyncio.Queue(maxsize=prefetch)
+                await asyncio.gather(produce(queue), *(consume(queue) for _ in range(concurrency)))
+
+        # One pass over the finished log, rather than a rewrite of the whole document per image
+        if write_json:
+            jsonl_to_json(json_log_path, os.path.splitext(json_log_path)[0] + ".json")
+    finally:
+        # Saved even when the run is interrupted
+        save_patch_cache(cache_path, patch_cache)
+
+async def main(args, executor=None):
+    """
+    Processes the input folder, or each of its subfolders when it holds no JPEG files itself.
+    All folders are processed in a single event loop, so the OpenAI client's connections are reused,
+    and share the preprocessing `executor` when one is given.
+    """
+    # If no JPEG files at top level, process each subfolder separately
+    top_jpg = list_jpgs(args.input)
+    if not top_jpg:
+        # Determine global flash folder for skip logic
+        flash_folder = os.path.join(args.output, 'flash')
+        with os.scandir(args.input) as entries:
+            subfolders = sorted(entry.name for entry in entries if entry.is_dir())
+        for sub in subfolders:
+            sub_input = os.path.join(args.input, sub)
+            # Skip entire subfolder if all images already processed
+            input_files = set(list_jpgs(sub_input))
+            night_subfolder = os.path.join(args.output, 'night', sub)
+            existing = set()
+            if os.path.exists(night_subfolder):
+                existing.update(os.listdir(night_subfolder))
+            if os.path.exists(flash_folder):
+                existing.update(input_files.intersection(os.listdir(flash_folder)))
+            if input_files.issubset(existing):
+                print(f"Skipping already processed folder: {sub_input}")
+                continue
+            # The folders are not listed again by process_images
+            filenames = sorted(input_files - existing)
+            await process_images(
+                sub_input, args.output, args.model, args.patch,
+                kernel_diameter=args.kernel_diameter,
+                contrast_factor=args.contrast_factor,
+                detail=args.detail,
+                sensitivity=args.sensitivity,
+                master_input=args.input,
+                concurrency=args.concurrency,
+                use_batch=args.batch,
+                resample=args.resample,
+                draft=args.draft,
+                reducing_gap=args.reducing_gap,
+                jpeg_quality=args.jpeg_quality,
+                dark_threshold=args.dark_threshold,
+                early_exit_conf=args.early_exit_conf,
+                multi=args.multi,
+                workers=args.workers,
+                executor=executor,
+                prefetch=args.prefetch,
+                logprobs=not args.no_logprobs,
+                write_json=args.json,
+                triage=args.triage,
+                filenames=filenames
+            )
+    else:
+        await process_images(
+            args.input, args.output, args.model, args.patch,
+            kernel_diameter=args.kernel_diameter,
+            contrast_factor=args.contrast_factor,
+            detail=args.detail,
+            sensitivity=args.sensitivity,
+            master_input=args.input,
+            concurrency=args.concurrency,
+            use_batch=args.batch,
+            resample=args.resample,
+            draft=args.draft,
+            reducing_gap=args.reducing_gap,
+            jpeg_quality=args.jpeg_quality,
+            dark_threshold=args.dark_threshold,
+            early_exit_conf=args.early_exit_conf,
+            multi=args.multi,
+            workers=args.workers,
+            executor=executor,
+            prefetch=args.prefetch,
+            logprobs=not args.no_logprobs,
+            write_json=args.json,
+            triage=args.triage
+        )
+
+def prevent_sleep():
+    """
+    Keeps the Mac awake while the script runs (caffeinate, which also exits on its own if the
+    script dies). Returns the caffeinate process, or None on other platforms, where nothing is done.
+    """
+    if sys.platform != "darwin":
+        return None
+    return subprocess.Popen(["caffeinate", "-ims", "-w", str(os.getpid())])
 
 if __name__ == "__main__":
-    # Prevent system sleep.
-    caffeinate_process = subprocess.Popen(["caffeinate", "-ims"])
+    # Prevent system sleep (macOS only).
+    caffeinate_process = prevent_sleep()
     try:
         parser = argparse.ArgumentParser(description="Process images for firefly flash detection.")
         parser.add_argument("--input", "-i", type=str, required=True, help="Path to the input folder containing images.")
@@ -273,47 +888,50 @@ if __name__ == "__main__":
         # --nonight removed
         parser.add_argument("--kernel_diameter", "-kd", type=int, default=3, help="Kernel diameter for dilation (default: 3).")
         parser.add_argument("--contrast_factor", "-cf", type=float, default=1.5, help="Contrast enhancement factor (default: 1.5).")
+        parser.add_argument("--resample", type=str, default="lanczos", choices=list(RESAMPLE_FILTERS),
+                            help="Filter for resizing into patches; faster filters trade some sharpness (default: lanczos).")
+        parser.add_argument("--draft", action="store_true",
+                            help="Decode JPEGs at reduced scale when the patches are smaller anyway (patch modes 1 and 2); faster, slightly softer.")
+        parser.add_argument("--reducing_gap", type=float, default=None,
+                            help="Shrink by an integer factor before the resize filter while at least this many times the patch size "
+                                 "remains (e.g. 2.0); much faster resize, nearly identical patches (default: off).")
+        parser.add_argument("--jpeg_quality", type=int, default=75,
+                            help="JPEG quality of the patches sent; lower values shrink the requests (default: 75).")
+        parser.add_argument("--dark_threshold", type=float, default=0,
+                            help="Classify patches whose mean grey level is below this (e.g. 5) and nearly uniform as 'dark' "
+                                 "without a request; 1%% of them are still sent as a check (default: 0, off).")
+        parser.add_argument("--multi", action="store_true",
+                            help="Send all patches of an image in one request and ask for one answer per patch.")
         parser.add_argument("--detail", type=str, default="high", choices=["low", "high"], help="Pass image as low (85 tokens) or high detail.")
+        parser.add_argument("--triage", type=float, default=None,
+                            help="Screen the patches at low detail, and re-check at high detail those whose 'yes' probability "
+                                 "exceeds this threshold (e.g. 0.2) without being positive; overrides --detail.")
+        parser.add_argument("--early_exit_conf", type=float, default=None,
+                            help=f"Skip an image's remaining patches when its first {EARLY_EXIT_PATCHES} are all 'no' with a probability "
+                                 "above this (e.g. 0.95); fewer requests on mostly-empty nights, at some risk of missing a flash.")
         parser.add_argument("--sensitivity", type=float, default=0.5, help="Probability threshold for classifying a patch as positive (default: 0.5).")
+        parser.add_argument("--no_logprobs", action="store_true",
+                            help="Request the answer text only; patches are positive on a 'yes' answer and --sensitivity is ignored.")
+        parser.add_argument("--concurrency", "-c", type=int, default=8, help="Number of images classified at a time (default: 8).")
+        parser.add_argument("--workers", "-w", type=int, default=None, help="Number of preprocessing processes (default: one per core).")
+        parser.add_argument("--prefetch", type=int, default=8, help="Number of images preprocessed ahead of the classification (default: 8).")
+        parser.add_argument("--rpm", type=int, default=0, help="Requests per minute allowed by the account (default: 0, unlimited).")
+        parser.add_argument("--tpm", type=int, default=0, help="Input tokens per minute allowed by the account (default: 0, unlimited).")
+        parser.add_argument("--batch", action="store_true", help="Classify through the Batch API (half price, results within 24 h) instead of live requests.")
+        parser.add_argument("--json", action="store_true", help="Also write each folder's results as a single JSON document (results_<folder>.json) when it is done.")
         args = parser.parse_args()
+        if args.triage is not None and (args.batch or args.no_logprobs):
+            parser.error("--triage needs live requests with logprobs (not --batch or --no_logprobs)")
+        if args.early_exit_conf is not None and (args.batch or args.no_logprobs):
+            parser.error("--early_exit_conf needs live requests with logprobs (not --batch or --no_logprobs)")
 
-        # If no JPEG files at top level, process each subfolder separately
-        top_jpg = [f for f in os.listdir(args.input) if f.lower().endswith('.jpg')]
-        if not top_jpg:
-            # Determine global flash folder for skip logic
-            flash_folder = os.path.join(args.output, 'flash')
-            for sub in sorted(os.listdir(args.input)):
-                sub_input = os.path.join(args.input, sub)
-                if os.path.isdir(sub_input):
-                    # Skip entire subfolder if all images already processed
-                    input_files = [f for f in os.listdir(sub_input) if f.lower().endswith('.jpg')]
-                    night_subfolder = os.path.join(args.output, 'night', sub)
-                    existing = set()
-                    if os.path.exists(night_subfolder):
-                        existing.update(os.listdir(night_subfolder))
-                    if os.path.exists(flash_folder):
-                        existing.update([f for f in os.listdir(flash_folder) if f in input_files])
-                    if set(input_files).issubset(existing):
-                        print(f"Skipping already processed folder: {sub_input}")
-                        continue
-                    process_images(
-                        sub_input, args.output, args.model, args.patch,
-                        kernel_diameter=args.kernel_diameter,
-                        contrast_factor=args.contrast_factor,
-                        detail=args.detail,
-                        sensitivity=args.sensitivity,
-                        master_input=args.input
-                    )
-        else:
-            process_images(
-                args.input, args.output, args.model, args.patch,
-                kernel_diameter=args.kernel_diameter,
-                contrast_factor=args.contrast_factor,
-                detail=args.detail,
-                sensitivity=args.sensitivity,
-                master_input=args.input
-            )
+        RATE_LIMITER = RateLimiter(args.rpm, args.tpm)
+
+        # One process pool for all folders, so that its workers are only started once
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            asyncio.run(main(args, executor))
     finally:
-        caffeinate_process.terminate()  # Stop caffeinate when done.
+        if caffeinate_process is not None:
+            caffeinate_process.terminate()  # Stop caffeinate when done.
         
 # python tg_gpt_folder.py --model "gpt-4.1-mini" --input /Users/rss367/Desktop/2024bww/Muleshoe/results/UpperBass/dusk --output /Users/rss367/Desktop/2024bww/Muleshoe/results/UpperBass/dusk/_41mini
\ No newline at end of file
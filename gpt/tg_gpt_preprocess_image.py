@@ -19,33 +19,118 @@ Usage Example:
     patches = preprocess_image("path/to/image.jpg", kernel_diameter=5, contrast_factor=1.5, patch_mode="2")
     # 'patches' is a list of PIL.Image objects ready for further processing.
 
+Resizing dominates the preprocessing time. It runs much faster with Pillow-SIMD, a drop-in
+replacement of Pillow (`pip uninstall pillow && CC="cc -mavx2" pip install -U --force-reinstall pillow-simd`;
+PIL.__version__ then ends with ".postN"), with reducing_gap=2.0 (an integer-factor reduce before
+the filter), or with a cheaper filter (resample="bilinear").
+
 Date: 02/2025
 """
 
+import math
+from io import BytesIO
 import cv2
 import numpy as np
-from PIL import Image, ImageEnhance
+from PIL import Image
+
+# PyTurboJPEG is optional: when installed (with libjpeg-turbo) the patches are encoded straight
+# from their pixel arrays; otherwise Pillow encodes them.
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJPF_GRAY, TJSAMP_420, TJSAMP_GRAY
+    _TURBOJPEG = TurboJPEG()
+except (ImportError, OSError):
+    _TURBOJPEG = None
+
+# Resampling filters available for the patch resize, from fastest to sharpest
+RESAMPLE_FILTERS = {
+    "nearest": Image.NEAREST,
+    "bilinear": Image.BILINEAR,
+    "bicubic": Image.BICUBIC,
+    "lanczos": Image.LANCZOS,
+}
+
+# Crop applied to the full-resolution picture (the bottom margin holds the info banner)
+CROP_HEIGHT = 1280
+BOTTOM_MARGIN = 140
+
+def patch_grid(rows, cols, size=512):
+    """Array slices of size x size patches, row by row in the given row order."""
+    return tuple((slice(i * size, (i + 1) * size), slice(j * size, (j + 1) * size))
+                 for i in rows for j in range(cols))
 
-def crop_image(image_path):
+# Plan of each patch mode, computed once: the (width, height) the crop is resized to, the vertical
+# band of the crop that is resized (as fractions of its height), and the array slices of the patches
+PATCH_PLANS = {
+    "1":  ((1024, 512),  (0, 1),   ((slice(0, 512), slice(0, 1024)),)),  # the whole resized image
+    "2":  ((1024, 512),  (0, 1),   patch_grid([0], 2)),
+    "4d": ((2048, 512),  (0.5, 1), patch_grid([0], 4)),
+    "4u": ((2048, 512),  (0, 0.5), patch_grid([0], 4)),
+    "8":  ((2048, 1024), (0, 1),   patch_grid([1, 0], 4)),  # bottom row first
+}
+
+# Width of the resized image each patch mode is cut from
+PATCH_MODE_WIDTHS = {patch_mode: plan[0][0] for patch_mode, plan in PATCH_PLANS.items()}
+
+def crop_image(image_path, target_width=None):
     """
     Opens the image and crops it using preset parameters.
 
     The image is cropped to a fixed height (1280) with a bottom margin (140).
+    With `target_width`, the JPEG is decoded directly at 1/2, 1/4 or 1/8 scale (libjpeg DCT scaling),
+    as long as the picture stays at least that wide; the crop is scaled accordingly.
 
     Returns:
         PIL.Image: The cropped image.
     """
     with Image.open(image_path) as img:
         width, height = img.size
-        crop_height = 1280
-        bottom_margin = 140
+        crop_height = CROP_HEIGHT
+        bottom_margin = BOTTOM_MARGIN
+        if target_width:
+            ratio = target_width / width
+            img.draft(img.mode, (math.ceil(width * ratio), math.ceil(height * ratio)))
+            scale = img.size[0] / width
+            width, height = img.size
+            crop_height = round(crop_height * scale)
+            bottom_margin = round(bottom_margin * scale)
         top_margin = height - crop_height - bottom_margin
 
         # Crop the image: (left, top, right, bottom)
         cropped_img = img.crop((0, top_margin, width, height - bottom_margin))
         return cropped_img
 
-def enhance_image(image, kernel_diameter, contrast_factor):
+# Structuring elements, keyed by (kernel diameter, separable)
+_KERNEL_CACHE = {}
+
+def get_kernel(kernel_diameter, separable=False):
+    """
+    Returns the (cached) structuring element of the given diameter: elliptical, or square when
+    `separable` (OpenCV dilates with a rectangle as a row pass then a column pass, O(K) per pixel).
+    """
+    key = (kernel_diameter, separable)
+    kernel = _KERNEL_CACHE.get(key)
+    if kernel is None:
+        shape = cv2.MORPH_RECT if separable else cv2.MORPH_ELLIPSE
+        kernel = cv2.getStructuringElement(shape, (kernel_diameter, kernel_diameter))
+        _KERNEL_CACHE[key] = kernel
+    return kernel
+
+# Contrast lookup tables, keyed by (contrast factor, mean grey level)
+_LUT_CACHE = {}
+
+def get_contrast_lut(contrast_factor, mean):
+    """
+    Returns the 256-entry table mapping x to mean + factor * (x - mean), clipped and truncated
+    to uint8 like PIL's ImageEnhance.Contrast (a blend with the mean grey level).
+    """
+    key = (contrast_factor, mean)
+    lut = _LUT_CACHE.get(key)
+    if lut is None:
+        lut = np.clip(mean + contrast_factor * (np.arange(256, dtype=np.float32) - mean), 0, 255).astype(np.uint8)
+        _LUT_CACHE[key] = lut
+    return lut
+
+def enhance_image(image, kernel_diameter, contrast_factor, separable=False):
     """
     Enhances the image by applying dilation and contrast enhancement.
 
@@ -53,23 +138,28 @@ def enhance_image(image, kernel_diameter, contrast_factor):
         image (PIL.Image): The image to enhance.
         kernel_diameter (int): Diameter of the morphological kernel.
         contrast_factor (float): Factor to enhance contrast.
+        separable (bool): Dilate with a square instead of an ellipse; faster for large kernels,
+            and spreads bright points slightly further along the diagonals (default: False).
 
     Returns:
         PIL.Image: The enhanced image.
     """
-    # Convert image to NumPy array for dilation
+    # Convert image to NumPy array once; both steps then run in place with OpenCV
     img_np = np.array(image)
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_diameter, kernel_diameter))
-    dilated_np = cv2.dilate(img_np, kernel)
-    img_dilated = Image.fromarray(dilated_np)
+    cv2.dilate(img_np, get_kernel(kernel_diameter, separable), dst=img_np)
     
-    # Enhance the contrast
-    enhancer = ImageEnhance.Contrast(img_dilated)
-    enhanced_img = enhancer.enhance(contrast_factor)
+    # Enhance the contrast the way PIL's ImageEnhance.Contrast does, with a lookup table
+    # centred on the mean grey level (taken from the per-channel means of the RGB array)
+    if img_np.ndim == 3:
+        mean_r, mean_g, mean_b, _ = cv2.mean(img_np)
+        mean = int(0.299 * mean_r + 0.587 * mean_g + 0.114 * mean_b + 0.5)
+    else:
+        mean = int(cv2.mean(img_np)[0] + 0.5)
+    cv2.LUT(img_np, get_contrast_lut(contrast_factor, mean), dst=img_np)
     
-    return enhanced_img
+    return Image.fromarray(img_np)
 
-def split_into_patches(image, patch_mode):
+def split_into_patches(image, patch_mode, resample=Image.LANCZOS, reducing_gap=None):
     """
     Splits the enhanced image into patches based on the specified patch mode.
     
@@ -79,58 +169,32 @@ def split_into_patches(image, patch_mode):
         "4d" - Crops the bottom half (from 640 to 1280), resizes to 2048x512, then splits into four patches.
         "4u" - Crops the top half (first 640 pixels), resizes to 2048x512, then splits into four patches.
         "8"  - Resizes to 2048x1024 and splits into eight 512x512 patches.
+
+    The resizes use the `resample` filter (default: Image.LANCZOS). With `reducing_gap` (e.g. 2.0),
+    Pillow first shrinks the image by an integer factor with a box filter, as long as at least
+    `reducing_gap` times the output size remains, and only runs the filter on what is left:
+    much faster for the large downscales, nearly identical output.
     
     Returns:
         list of PIL.Image: A list of image patches.
     """
-    width, height = image.size
+    plan = PATCH_PLANS.get(patch_mode)
+    if plan is None:
+        raise ValueError("Invalid patch mode. Must be one of: '1', '2', '4d', '4u', or '8'.")
+    size, (top, bottom), patch_slices = plan
 
-    if patch_mode == "1":
-        # Resize full image to 1024x512 before returning
-        resized_img = image.resize((1024, 512), Image.LANCZOS)
+    # A single resize of the band the patches are cut from
+    width, height = image.size
+    box = None if (top, bottom) == (0, 1) else (0, int(height * top), width, int(height * bottom))
+    resized_img = image.resize(size, resample, box=box, reducing_gap=reducing_gap)
+    if len(patch_slices) == 1:
         return [resized_img]
 
-    elif patch_mode == "2":
-        # Resize to 1024x512 and split into two 512x512 patches
-        resized_img = image.resize((1024, 512), Image.LANCZOS)
-        left_patch = resized_img.crop((0, 0, 512, 512))
-        right_patch = resized_img.crop((512, 0, 1024, 512))
-        return [left_patch, right_patch]
-
-    elif patch_mode == "4d":
-        # Crop the bottom portion: from 640 to 1280
-        bottom_cropped_img = image.crop((0, 640, width, 1280))
-        resized_img = bottom_cropped_img.resize((2048, 512), Image.LANCZOS)
-        patches = []
-        for i in range(4):
-            patch = resized_img.crop((i * 512, 0, (i + 1) * 512, 512))
-            patches.append(patch)
-        return patches
-
-    elif patch_mode == "4u":
-        # Crop the top portion: first 640 pixels
-        top_cropped_img = image.crop((0, 0, width, 640))
-        resized_img = top_cropped_img.resize((2048, 512), Image.LANCZOS)
-        patches = []
-        for i in range(4):
-            patch = resized_img.crop((i * 512, 0, (i + 1) * 512, 512))
-            patches.append(patch)
-        return patches
-
-    elif patch_mode == "8":
-        # Resize to 2048x1024 and split into eight 512x512 patches
-        resized_img = image.resize((2048, 1024), Image.LANCZOS)
-        patches = []
-        for i in range(1, -1, -1):
-            for j in range(4):
-                patch = resized_img.crop((j * 512, i * 512, (j + 1) * 512, (i + 1) * 512))
-                patches.append(patch)
-        return patches
-
-    else:
-        raise ValueError("Invalid patch mode. Must be one of: '1', '2', '4d', '4u', or '8'.")
+    # The pixels are converted to an array once and each patch is a slice of it
+    arr = np.asarray(resized_img)
+    return [Image.fromarray(arr[patch_slice]) for patch_slice in patch_slices]
 
-def preprocess_image(file_path, kernel_diameter=5, contrast_factor=1.5, patch_mode="2"):
+def preprocess_image(file_path, kernel_diameter=5, contrast_factor=1.5, patch_mode="2", resample="lanczos", draft=False, reducing_gap=None, separable=False):
     """
     Full preprocessing pipeline:
       1. Crop the image.
@@ -142,11 +206,57 @@ def preprocess_image(file_path, kernel_diameter=5, contrast_factor=1.5, patch_mo
         patch_mode (str): One of "1", "2", "4d", "4u", or "8". Default is "2".
         kernel_diameter (int): Diameter for dilation (default: 5).
         contrast_factor (float): Factor for contrast enhancement (default: 1.5).
+        resample (str): Resize filter, one of RESAMPLE_FILTERS (default: "lanczos").
+        draft (bool): Decode the JPEG at reduced scale when the patches are smaller anyway
+            (patch modes "1" and "2"); the dilation kernel is scaled along, to the nearest odd
+            diameter so it stays centred, e.g. 3 -> 1 and 5 -> 3 at half scale (default: False).
+        reducing_gap (float): Passed to the resize, see split_into_patches (default: None, exact resize).
+        separable (bool): Dilate with a square kernel, see enhance_image (default: False).
     
     Returns:
         list of PIL.Image: A list of processed image patches.
     """
-    cropped = crop_image(file_path)
-    enhanced = enhance_image(cropped, kernel_diameter, contrast_factor)
-    patches = split_into_patches(enhanced, patch_mode)
-    return patches
\ No newline at end of file
+    if draft:
+        cropped = crop_image(file_path, PATCH_MODE_WIDTHS[patch_mode])
+        # Scale the dilation footprint along, rounded to the nearest odd diameter
+        # (an even kernel has no centre pixel and shifts the flashes)
+        scale = cropped.height / CROP_HEIGHT
+        kernel_diameter = max(1, 2 * round((kernel_diameter * scale - 1) / 2) + 1)
+    else:
+        cropped = crop_image(file_path)
+    enhanced = enhance_image(cropped, kernel_diameter, contrast_factor, separable)
+    patches = split_into_patches(enhanced, patch_mode, RESAMPLE_FILTERS[resample], reducing_gap)
+    return patches
+
+def encode_patch(patch, quality=75):
+    """
+    JPEG-encodes the patch (PIL.Image) in memory; returns the encoded bytes.
+    Same settings as Pillow's defaults (4:2:0 chroma subsampling, quality 75 unless given),
+    with either encoder.
+    """
+    if _TURBOJPEG is not None and patch.mode in ("RGB", "L"):
+        if patch.mode == "RGB":
+            return _TURBOJPEG.encode(np.asarray(patch), quality=quality, pixel_format=TJPF_RGB, jpeg_subsample=TJSAMP_420)
+        return _TURBOJPEG.encode(np.asarray(patch)[:, :, np.newaxis], quality=quality, pixel_format=TJPF_GRAY, jpeg_subsample=TJSAMP_GRAY)
+    buf = BytesIO()
+    patch.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+def luma_stats(patch):
+    """
+    Mean and standard deviation of the patch's grey levels, measured on a 32x32 thumbnail
+    (enough to tell a uniformly dark frame, for a fraction of the cost of the full patch).
+    """
+    thumbnail = np.asarray(patch.convert("L").resize((32, 32), Image.BILINEAR), dtype=np.float32)
+    return float(thumbnail.mean()), float(thumbnail.std())
+
+def preprocess_image_jpeg(file_path, quality=75, **kwargs):
+    """
+    Runs preprocess_image (same keyword arguments) and JPEG-encodes the patches at the given quality.
+    Only bytes, sizes and grey-level statistics are returned, so this can run in a process pool.
+
+    Returns:
+        list of (bytes, (int, int), (float, float)): The JPEG bytes, size and luma_stats of each patch.
+    """
+    return [(encode_patch(patch, quality), patch.size, luma_stats(patch))
+            for patch in preprocess_image(file_path, **kwargs)]
@@ -4,17 +4,31 @@
 # Results are logged, and positive detections are saved to an output folder.
 
 # Usage:
-# python script_name.py --input <input_folder> --output <output_folder> --results_file <results_file> --patch <patch_mode>
+# python script_name.py --input <input_folder> --output <output_folder> --results_file <results_file> --patch <patch_mode> [--jobs N]
 # Example:
 # python script_name.py --input ./images --output ./results --results_file detection_log.txt --patch 4
+# With --jobs N, N images are classified at a time (one llava-cli process each); size N to the memory
+# the model needs per process.
 
 import os
 import subprocess
 import shutil
 import argparse
-import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from PIL import Image
 
+# PyTurboJPEG is optional: when installed (with libjpeg-turbo) it writes the patches, otherwise Pillow does
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJSAMP_420
+    _TURBOJPEG = TurboJPEG()
+except (ImportError, OSError):
+    _TURBOJPEG = None
+
+# The patches only live while llava-cli reads them: keep them in memory-backed /dev/shm where it exists
+PATCH_TEMP_ROOT = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
 def run_llava(shell_script_path, image_path):
     # Run the shell script with the image path as an argument
     result = subprocess.run([shell_script_path, image_path], stdout=subprocess.PIPE, text=True)
@@ -36,6 +50,14 @@ def extract_relevant_output(output):
     except ValueError:
         return "Relevant output not found"
 
+def save_patch(patch, patch_path):
+    # Same settings either way: Pillow's JPEG defaults (quality 75, 4:2:0 chroma subsampling)
+    if _TURBOJPEG is not None and patch.mode == "RGB":
+        with open(patch_path, "wb") as f:
+            f.write(_TURBOJPEG.encode(np.asarray(patch), quality=75, pixel_format=TJPF_RGB, jpeg_subsample=TJSAMP_420))
+    else:
+        patch.save(patch_path)
+
 def crop_and_split_image(image_path, temp_dir, patch):
     # Open the image
     image = Image.open(image_path)
@@ -63,54 +85,56 @@ def crop_and_split_image(image_path, temp_dir, patch):
             bottom = top + patch_height
             patch = cropped_image.crop((left, top, right, bottom))
             patch_path = os.path.join(temp_dir, f"patch_{digits}_{i}_{j}.JPG")
-            patch.save(patch_path)
+            save_patch(patch, patch_path)
             patch_paths.append(patch_path)
 
     return patch_paths
 
-def main(image_dir, output_dir, results_file, patch):
+def classify_patches(shell_script_path, image_path, patch):
+    # Classify the patches of one image in order, stopping at the first positive one.
+    # Returns the (patch name, relevant output, positive) of each patch classified.
+    # The patches are written to a temporary folder of their own, removed with them afterwards.
+    with tempfile.TemporaryDirectory(prefix="llava_patches_", dir=PATCH_TEMP_ROOT) as temp_dir:
+        patch_paths = crop_and_split_image(image_path, temp_dir, patch)
+
+        results = []
+        for patch_path in patch_paths:
+            patch_output = run_llava(shell_script_path, patch_path)
+            positive = process_output(patch_output)
+            results.append((os.path.basename(patch_path), extract_relevant_output(patch_output), positive))
+            if positive:
+                break
+
+    return results
+
+def main(image_dir, output_dir, results_file, patch, jobs=1):
     positive_dir = os.path.join(output_dir, f'_positive_llava_patch{patch}')
     os.makedirs(positive_dir, exist_ok=True)
 
-    temp_dir = os.path.join(image_dir, '_temp_patches')
-    os.makedirs(temp_dir, exist_ok=True)
-
     filenames = sorted([f for f in os.listdir(image_dir) if f.lower().endswith('.jpg') and f.startswith('DSCF')])
 
     print(f"Found {len(filenames)} images")
 
+    shell_script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../private/run_llava.sh') # replace with your own path and completed script
+    image_paths = [os.path.abspath(os.path.join(image_dir, filename)) for filename in filenames]
+
     # Open the results file in append mode
-    with open(results_file, 'a') as results_file:
-        for filename in filenames:
-            image_path = os.path.join(image_dir, filename)
-            absolute_image_path = os.path.abspath(image_path)
+    with open(results_file, 'a') as results_file, ThreadPoolExecutor(max_workers=jobs) as executor:
+        # The images are classified by `jobs` threads, each waiting on its own llava-cli process;
+        # the results come back in image order and are only written here.
+        patch_results = executor.map(lambda path: classify_patches(shell_script_path, path, patch), image_paths)
+        for absolute_image_path, results in zip(image_paths, patch_results):
             print(f"Processing image: {absolute_image_path}")
 
-            patch_paths = crop_and_split_image(image_path, temp_dir, patch)
-
-            for patch_path in patch_paths:
-                patch_name = os.path.basename(patch_path)
+            for patch_name, relevant_output, positive in results:
                 print(f"Processing patch: {patch_name}")
-                patch_output = run_llava(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../private/run_llava.sh'), patch_path) # replace with your own path and completed script
-                
-                # Extract relevant output
-                relevant_output = extract_relevant_output(patch_output)
-                
                 print("Output from llava-cli:")
                 print(relevant_output)
-                
-                patch_result = "Positive" if process_output(patch_output) else "Negative"
+
                 results_file.write(f"Image: {absolute_image_path}\nPatch: {patch_name}\nOutput: {relevant_output}\n\n")
 
-                if patch_result == "Positive":
+                if positive:
                     shutil.copy(absolute_image_path, positive_dir)
-                    break
-
-            for patch_path in patch_paths:
-                os.remove(patch_path)
-                
-            # Add a sleep after processing each image
-            time.sleep(1) # who knows if it does anything?
 
     print("Processing complete.")
 
@@ -122,8 +146,9 @@ if __name__ == "__main__":
         parser.add_argument("--output", type=str, required=True, help="Path to the output folder for classified images.")
         parser.add_argument("--results_file", type=str, required=True, help="Path to the results file.")
         parser.add_argument("--patch", type=int, default=1, choices=[1, 2, 4, 6, 8], help="Number of patches to split the image into.")
+        parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of images classified at a time (default: 1).")
         args = parser.parse_args()
 
-        main(args.input, args.output, args.results_file, args.patch)
+        main(args.input, args.output, args.results_file, args.patch, args.jobs)
     finally:
         caffeinate_process.terminate()  # Ensure caffeinate is stopped
@@ -1,8 +1,10 @@
 import os
 import shutil
+import functools
+import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
 from matplotlib.widgets import Button
+from PIL import Image
 
 
 
@@ -36,19 +38,33 @@ def main(folder):
     fig, ax = plt.subplots(figsize=(10, 5))
     plt.subplots_adjust(left=0, right=1, bottom=0.1)
 
+    # The last few images shown stay decoded, so that going back and forth is instant
+    @functools.lru_cache(maxsize=8)
+    def load_image(filepath):
+        with Image.open(filepath) as img:
+            if img.mode not in ('RGB', 'RGBA', 'L'):
+                img = img.convert('RGB')
+            # Crop to top 1280 rows and use red channel as grayscale data,
+            # so only that band is converted to an array
+            return np.asarray(img.crop((0, 0, img.width, min(img.height, 1280))).getchannel(0))
+
+    # A single image artist, whose data, colormap and scaling are updated for each image
+    image_artist = None
+
     def show_image():
-        ax.clear()
+        nonlocal image_artist
         name, status = images[idx]
         filepath = os.path.join(folder if status == 'main' else rejected_folder, name)
-        img = mpimg.imread(filepath)
-        # Crop to top 1280 rows
-        img = img[:1280, :, :]
-
-        # Use red channel as grayscale data
-        data = img[:, :, 0]
-        ax.imshow(data, cmap='jet' if use_jet else 'gray')
+        data = load_image(filepath)
+        if image_artist is None:
+            image_artist = ax.imshow(data, cmap='jet' if use_jet else 'gray')
+            ax.axis('off')
+        else:
+            image_artist.set_data(data)
+            image_artist.set_extent((-0.5, data.shape[1] - 0.5, data.shape[0] - 0.5, -0.5))
+            image_artist.set_cmap('jet' if use_jet else 'gray')
+            image_artist.autoscale()
         ax.set_title(f"{name} ({idx+1}/{len(images)})")
-        ax.axis('off')
 
         # Highlight Accept/Reject buttons based on status
         if status == 'rejected':
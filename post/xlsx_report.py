@@ -25,171 +25,131 @@ from PIL import Image, ExifTags
 import pandas as pd
 from datetime import datetime
 import re
+from concurrent.futures import ProcessPoolExecutor
 
 
 
 
 
-def extract_datetime(path):
-    """
-    Try to pull DateTimeOriginal (or fallback DateTime) EXIF tag
-    Returns a datetime.datetime or None
-    """
-    try:
-        img = Image.open(path)
-        exif = img._getexif()
-        if not exif:
-            return None
-        # map tag names to keys
-        tag_map = {ExifTags.TAGS[k]: k for k in exif.keys() if k in ExifTags.TAGS}
-        for tag_name in ("DateTimeOriginal", "DateTime", "DateTimeDigitized"):
-            if tag_name in tag_map:
-                dt_str = exif[tag_map[tag_name]]
-                # EXIF format is "YYYY:MM:DD HH:MM:SS"
-                return datetime.strptime(dt_str, "%Y:%m:%d %H:%M:%S")
-    except Exception:
-        pass
-    return None
+# EXIF tag ids, looked up once
+DATETIME_TAGS = [k for name in ("DateTimeOriginal", "DateTime", "DateTimeDigitized")
+                 for k, v in ExifTags.TAGS.items() if v == name]
+MAKER_NOTE_TAG = next((k for k, v in ExifTags.TAGS.items() if v == "MakerNote"), None)
+
+# Number of files handed to an EXIF-reading process at a time
+EXIF_CHUNKSIZE = 64
 
 
-# --- New helper function: extract_temperature
-def extract_temperature(path):
+def extract_exif(path):
     """
-    Extracts temperature from the MakerNote EXIF tag by finding the typoed 'tempture' pattern
-    and reading the two characters following it. Returns an int or None.
+    Reads the EXIF block once (Image.open only parses the headers, no pixels are decoded) and returns
+    (datetime, temperature):
+      - datetime: DateTimeOriginal (or fallback DateTime, DateTimeDigitized) as a datetime.datetime, or None
+      - temperature: int read from the MakerNote, the two characters after the typoed 'tempture'
+        pattern, or None
     """
     try:
-        img = Image.open(path)
-        exif = img._getexif()
-        if not exif:
-            return None
-        # Find MakerNote tag key
-        maker_tag = next((k for k, v in ExifTags.TAGS.items() if v == "MakerNote"), None)
-        if maker_tag is None or maker_tag not in exif:
-            return None
-        maker = exif[maker_tag]
-        if isinstance(maker, bytes):
-            maker = maker.decode(errors="ignore")
+        with Image.open(path) as img:
+            exif = img._getexif()
+    except Exception:
+        return None, None
+    if not exif:
+        return None, None
+
+    dt = None
+    for tag in DATETIME_TAGS:
+        if tag in exif:
+            try:
+                # EXIF format is "YYYY:MM:DD HH:MM:SS"
+                dt = datetime.strptime(exif[tag], "%Y:%m:%d %H:%M:%S")
+            except (TypeError, ValueError):
+                pass
+            break
+
+    temp = None
+    maker = exif.get(MAKER_NOTE_TAG)
+    if isinstance(maker, str):
+        maker = maker.encode(errors="ignore")
+    if isinstance(maker, bytes):
         # Look for the typoed pattern
-        pattern = "tempture"
-        idx = maker.find(pattern)
+        idx = maker.find(b"tempture")
         if idx != -1 and len(maker) >= idx + 11:
             # MATLAB uses k+9:k+10 in 1-based indexing; Python slice idx+9:idx+11 captures those two chars
-            temp_str = maker[idx + 9 : idx + 11]
             try:
-                return int(temp_str)
+                temp = int(maker[idx + 9 : idx + 11])
             except ValueError:
-                return None
-    except Exception:
-        pass
-    return None
+                pass
+    return dt, temp
 
 def main(input_folder, output_xlsx, start_date=None, end_date=None):
-    records = []
-    for fname in os.listdir(input_folder):
-        full = os.path.join(input_folder, fname)
-        if not os.path.isfile(full):
-            continue
-        dt = extract_datetime(full)
-        if dt:
-            date_str = dt.strftime("%Y-%m-%d")
-            time_str = dt.strftime("%H:%M:%S")
-        else:
-            date_str = None
-            time_str = None
-        temp = extract_temperature(full)
-        records.append({
-            "filename": fname,
-            "datetime": dt,
-            "date": date_str,
-            "time": time_str,
-            "temperature": temp
-        })
-
-    # Create DataFrame
-    df = pd.DataFrame(records)
-    # Only keep filename, date, time, and temperature, then sort by date & time
-    df = df[["filename", "date", "time", "temperature"]]
-    df["temperature_f"] = df["temperature"].apply(
-        lambda c: c * 9/5 + 32 if pd.notna(c) else None
-    )
-    df = df[["filename", "date", "time", "temperature", "temperature_f"]]
+    # scandir reports the entry types from the directory listing, without a stat per file
+    with os.scandir(input_folder) as it:
+        entries = [entry for entry in it if entry.is_file()]
+    # Pillow parses the EXIF tags in Python, so the files are spread over one process per core
+    # (in chunks, to amortize the inter-process round-trips)
+    with ProcessPoolExecutor() as executor:
+        exif_data = executor.map(extract_exif, [entry.path for entry in entries], chunksize=EXIF_CHUNKSIZE)
+    # One list per column (no per-photo dicts); undated photos get None date and time
+    dates, times, temps = [], [], []
+    for dt, temp in exif_data:
+        dates.append(dt.strftime("%Y-%m-%d") if dt else None)
+        times.append(dt.strftime("%H:%M:%S") if dt else None)
+        temps.append(temp)
+
+    # Create DataFrame: filename, date, time, and temperature (NaN when missing), then sort by date & time
+    df = pd.DataFrame({
+        "filename": [entry.name for entry in entries],
+        "date": dates,
+        "time": times,
+        "temperature": pd.Series(temps, dtype="float64"),
+    })
+    df["temperature_f"] = df["temperature"] * 9/5 + 32
     df.sort_values(by=["date", "time"], inplace=True)
 
-    # Count photos per day (skip None)
+    # Per-day photo count, earliest and latest photo times and average temperature, in one pass
+    # (days sort chronologically as "YYYY-MM-DD" strings; undated photos are skipped)
+    dated = df[df["date"].notna()]
     counts = (
-        df[df["date"].notna()]
+        dated.assign(time_dt=pd.to_datetime(dated["time"], format="%H:%M:%S"))
         .groupby("date")
-        .size()
-        .reset_index(name="count")
-        .sort_values("date")
-    )
-
-    # Compute earliest and latest photo times per day
-    # Convert 'time' strings to timestamps
-    df_times = df[df["time"].notna()].copy()
-    df_times["time_dt"] = pd.to_datetime(df_times["time"], format="%H:%M:%S")
-    extremes = (
-        df_times
-        .groupby("date")["time_dt"]
-        .agg(["min", "max"])
-        .reset_index()
-        .rename(columns={"min": "earliest", "max": "latest"})
+        .agg(
+            count=("filename", "size"),
+            earliest=("time_dt", "min"),
+            latest=("time_dt", "max"),
+            avg_temp=("temperature", "mean"),
+        )
     )
+    counts.index = pd.to_datetime(counts.index)
     # Convert earliest and latest to Excel time fractions for plotting
-    extremes["earliest"] = (
-        extremes["earliest"].dt.hour / 24
-        + extremes["earliest"].dt.minute / (24 * 60)
-        + extremes["earliest"].dt.second / (24 * 3600)
-    )
-    extremes["latest"] = (
-        extremes["latest"].dt.hour / 24
-        + extremes["latest"].dt.minute / (24 * 60)
-        + extremes["latest"].dt.second / (24 * 3600)
-    )
-    # Merge extremes into counts DataFrame
-    counts = counts.merge(extremes, on="date", how="left")
+    for col in ("earliest", "latest"):
+        counts[col] = (
+            counts[col].dt.hour / 24
+            + counts[col].dt.minute / (24 * 60)
+            + counts[col].dt.second / (24 * 3600)
+        )
 
     # If a start_date or end_date is provided, pad missing days with zero counts and NaN times
-    try:
-        if start_date or end_date:
-            counts["date"] = pd.to_datetime(counts["date"])
-            start = start_date or counts["date"].min()
-            end = end_date or counts["date"].max()
-            full_idx = pd.date_range(start=start, end=end, freq="D")
-            full_df = pd.DataFrame({"date": full_idx})
-            counts = full_df.merge(counts, on="date", how="left")
-            counts["count"] = counts["count"].fillna(0).astype(int)
-            # earliest/latest remain NaN for days without photos
-    except NameError:
-        pass
-
-    # Convert date column back to "YYYY-MM-DD" strings for counts sheet
-    counts["date"] = counts["date"].dt.strftime("%Y-%m-%d")
+    if start_date or end_date:
+        start = start_date or counts.index.min()
+        end = end_date or counts.index.max()
+        counts = counts.reindex(pd.date_range(start=start, end=end, freq="D"))
+        counts["count"] = counts["count"].fillna(0).astype(int)
+        # earliest/latest/avg_temp remain NaN for days without photos
+
     # Compute 7-day moving average of daily photo counts
-    counts["ma7"] = counts["count"].rolling(window=7, min_periods=1).mean()
-
-    # Compute average temperature per day and merge into counts
-    temp_avg = (
-        df[df["temperature"].notna()]
-        .groupby("date")["temperature"]
-        .mean()
-        .reset_index(name="avg_temp")
-    )
-    counts = counts.merge(temp_avg, on="date", how="left")
+    counts.insert(3, "ma7", counts["count"].rolling(window=7, min_periods=1).mean())
+    # Date column as "YYYY-MM-DD" strings for counts sheet
+    counts.insert(0, "date", counts.index.strftime("%Y-%m-%d"))
+    counts = counts.reset_index(drop=True)
 
     # Write to Excel with XlsxWriter engine and embed a chart
     with pd.ExcelWriter(output_xlsx, engine="xlsxwriter") as writer:
-        df.to_excel(writer, index=False, sheet_name="metadata")
-        # Make filenames in metadata sheet clickable via HYPERLINK formula
-        meta_ws = writer.sheets["metadata"]
-        for row_idx, fname in enumerate(df["filename"], start=1):
-            file_path = os.path.abspath(os.path.join(input_folder, fname))
-            # Build a hyperlink formula that falls back to the filename if the link is invalid
-            link = file_path
-            formula = f'=HYPERLINK("{link}", "{fname}")'
-            # formula = f'=IFERROR(HYPERLINK("{link}", "{fname}"), "{fname}")'
-            meta_ws.write_formula(row_idx, 0, formula)
+        # Make filenames in metadata sheet clickable via HYPERLINK formula; XlsxWriter writes
+        # strings starting with "=" as formulas, so they go out with the rest of the sheet
+        folder = os.path.abspath(input_folder)
+        links = [f'=HYPERLINK("{os.path.join(folder, fname)}", "{fname}")' for fname in df["filename"]]
+        # links = [f'=IFERROR(HYPERLINK("{os.path.join(folder, fname)}", "{fname}"), "{fname}")' for fname in df["filename"]]
+        df.assign(filename=links).to_excel(writer, index=False, sheet_name="metadata")
         counts.to_excel(writer, index=False, sheet_name="counts")
 
         workbook  = writer.book
@@ -10,13 +10,15 @@ Usage (in VS Code as separate cells):
 Loads precomputed image statistics from a NumPy .npz archive (produced by calculate_image_stats.py),
 displays a 2D histogram of mean red brightness vs. (std_red/mean_red) on a log scale,
 and then assigns each image to one of four categories (days, dusk, dark, null) based on
-user‐defined thresholds. Finally, it copies or symlinks each image into
+user‐defined thresholds. Finally, it writes one manifest per category (dest_folder/<category>.txt,
+one picture path per line) and, with `materialize`, copies or symlinks each image into
 dest_folder/<category>/<date_folder>/ for downstream processing.
 
 """
 
 # %% Load image_stats.npz and plot histogram
 
+import os
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.colors import LogNorm
@@ -27,27 +29,45 @@ npz_path = "/path/to/image_stats.npz"
 # load
 data = np.load(npz_path, allow_pickle=True)
 
-avg_red = data['avg_red']
-std_red = data['std_red']
-
-# std over mean
-ratio = np.zeros_like(std_red)
-nonzero = avg_red > 0
-ratio[nonzero] = std_red[nonzero] / avg_red[nonzero]
-
-# bins
-bins_x = np.arange(0, 32, 0.1)
-bins_y = np.arange(0, 0.5, 0.005)
+# float32 is plenty for brightness statistics, and halves the data the steps below go through
+avg_red = data['avg_red'].astype(np.float32)
+std_red = data['std_red'].astype(np.float32)
+
+# std over mean (0 for black pictures), in one pass
+ratio = np.divide(std_red, avg_red, out=np.zeros_like(std_red), where=avg_red > 0)
+
+# bins (uniform)
+step_x, step_y = 0.1, 0.005
+bins_x = np.arange(0, 32, step_x)
+bins_y = np.arange(0, 0.5, step_y)
+
+# 2D histogram: with uniform bins, each picture's bin index is computed directly
+# and all bins are counted by one bincount (no per-edge search).
+# The counts are kept next to the stats (image_stats_hist.npz), and reused by later runs
+# as long as the stats and the bins are unchanged
+hist_path = npz_path.replace('.npz', '_hist.npz')
+counts = None
+if os.path.exists(hist_path) and os.path.getmtime(hist_path) >= os.path.getmtime(npz_path):
+    with np.load(hist_path) as hist:
+        if np.array_equal(hist['bins_x'], bins_x) and np.array_equal(hist['bins_y'], bins_y):
+            counts = hist['counts']
+if counts is None:
+    nx, ny = len(bins_x) - 1, len(bins_y) - 1
+    ix = np.floor(avg_red / step_x).astype(np.intp)
+    iy = np.floor(ratio / step_y).astype(np.intp)
+    inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    counts = np.bincount(ix[inside] * ny + iy[inside], minlength=nx * ny).reshape(nx, ny)
+    np.savez(hist_path, counts=counts, bins_x=bins_x, bins_y=bins_y)
 
 plt.figure(figsize=(8, 6))
-h = plt.hist2d(
-    avg_red,
-    ratio,
-    bins=[bins_x, bins_y],
+mesh = plt.pcolormesh(
+    bins_x,
+    bins_y,
+    counts.T,
     cmap="turbo",
     norm=LogNorm(vmin=1)
 )
-plt.colorbar(h[3], label="count")
+plt.colorbar(mesh, label="count")
 plt.xlabel("mean picture brightness")
 plt.ylabel("std / mean")
 plt.title("histogram of image statistics")
@@ -66,67 +86,103 @@ max_s_m_threshold  = 0.25
 import os
 import numpy as np
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 # destination folder
 dest_folder = "/path/to/destinationFolder"
+# replicate the pictures under dest_folder/<category>/<date_folder>/; without it only the
+# manifests (and labels.npz) are written
+materialize = True
+# hard-link the (non-symlink) pictures instead of copying them when dest_folder is on the same drive
+use_hardlinks = True
 
 filenames    = data['filenames']
 folders      = data['folders']
 is_grayscale = data['is_grayscale']
-avg_red      = data['avg_red']
-std_red      = data['std_red']
-max_red      = data['max_red']
-
-# compute boolean masks
-null_TF = max_red < min_max_brightness              # pictures with no bright pixel (> min_max) so no flash
-days_TF = (~null_TF) & (~is_grayscale)              # pictures in color, indicating high brightness
-dark_TF = (                                         # pictures almost completely dark (low std/mean)
-    (avg_red < max_avg_brightness)
-    & (ratio < max_s_m_threshold)
-    & (~null_TF)
-    & (~days_TF)
-)
-dusk_TF = (~null_TF) & (~days_TF) & (~dark_TF)      # dark but not too dark pictures
+avg_red      = data['avg_red'].astype(np.float32)
+std_red      = data['std_red'].astype(np.float32)
+max_red      = data['max_red'].astype(np.float32)
+
+# label each picture with its category, the first condition that holds
+# (0: null, 1: days, 2: dark, 3: dusk)
+labels = np.select(
+    [
+        max_red < min_max_brightness,               # pictures with no bright pixel (> min_max) so no flash
+        ~is_grayscale,                              # pictures in color, indicating high brightness
+        (avg_red < max_avg_brightness)              # pictures almost completely dark (low std/mean)
+        & (ratio < max_s_m_threshold),
+    ],
+    [0, 1, 2],
+    default=3,                                      # dark but not too dark pictures
+).astype(np.uint8)
 
 categories = {
-    "days": np.where(days_TF)[0],
-    "dusk": np.where(dusk_TF)[0],
-    "dark": np.where(dark_TF)[0],
-    "null": np.where(null_TF)[0],
+    "days": np.flatnonzero(labels == 1),
+    "dusk": np.flatnonzero(labels == 3),
+    "dark": np.flatnonzero(labels == 2),
+    "null": np.flatnonzero(labels == 0),
 }
 
-# Create destination categories
-for cat in categories:
-    os.makedirs(os.path.join(dest_folder, cat), exist_ok=True)
+os.makedirs(dest_folder, exist_ok=True)
 
-# Copy or symlink files based on category
+# One manifest per category, listing the paths of its pictures (np.loadtxt(path, dtype=str)),
+# and the labels of all pictures, in the order of image_stats.npz
 for cat, indices in categories.items():
-    for idx in indices:
-        src_folder = folders[idx]
-        fname      = filenames[idx]
-        date_folder = os.path.basename(src_folder.rstrip(os.sep))
-        dest_subfolder = os.path.join(dest_folder, cat, date_folder)
-        os.makedirs(dest_subfolder, exist_ok=True)
-
-        src_path = os.path.join(src_folder, fname)
-        dest_path = os.path.join(dest_subfolder, fname)
-
-        try:
-            # If source is symlink, replicate; otherwise copy
-            if os.path.islink(src_path):
-                link_target = os.readlink(src_path)
-                os.symlink(link_target, dest_path)
-            else:
+    with open(os.path.join(dest_folder, f"{cat}.txt"), "w") as f:
+        f.write("".join(os.path.join(folders[i], filenames[i]) + "\n" for i in indices))
+np.savez_compressed(os.path.join(dest_folder, "labels.npz"), label=labels)
+
+# Create destination categories
+if materialize:
+    for cat in categories:
+        os.makedirs(os.path.join(dest_folder, cat), exist_ok=True)
+
+def copy_one(src_path, dest_path):
+    """Replicates src_path at dest_path (see use_hardlinks), printing a warning on failure."""
+    try:
+        # If source is symlink, replicate; otherwise hard-link or copy
+        if os.path.islink(src_path):
+            link_target = os.readlink(src_path)
+            os.symlink(link_target, dest_path)
+        elif use_hardlinks:
+            try:
+                os.link(src_path, dest_path)
+            except OSError:
+                # other drive (EXDEV) or filesystem without hard links
                 shutil.copy2(src_path, dest_path)
-        except Exception as e:
-            print(f"[Warning] Failed to copy {src_path} → {dest_path}: {e}")
+        else:
+            shutil.copy2(src_path, dest_path)
+    except Exception as e:
+        print(f"[Warning] Failed to copy {src_path} → {dest_path}: {e}")
+
+# The pictures come from a few source folders: their date folder is worked out once per
+# folder, and each picture only refers to its folder's number
+src_folders, folder_ids = np.unique(folders, return_inverse=True)
+date_folders = [os.path.basename(src_folder.rstrip(os.sep)) for src_folder in src_folders]
+
+# List the (source, destination) of every file, creating each date subfolder once
+jobs = []
+for cat, indices in (categories.items() if materialize else ()):
+    dest_subfolders = [os.path.join(dest_folder, cat, date_folder) for date_folder in date_folders]
+    for folder_id in np.unique(folder_ids[indices]):
+        os.makedirs(dest_subfolders[folder_id], exist_ok=True)
+
+    for idx in indices:
+        folder_id = folder_ids[idx]
+        fname     = filenames[idx]
+        jobs.append((os.path.join(src_folders[folder_id], fname), os.path.join(dest_subfolders[folder_id], fname)))
+
+# Copy or symlink files based on category; the work is only file system calls,
+# so several threads keep the drive busy
+with ThreadPoolExecutor(max_workers=16) as executor:
+    list(executor.map(lambda job: copy_one(*job), jobs))
 
 # Write thresholds.txt
 thresholds_txt = os.path.join(dest_folder, "thresholds.txt")
 with open(thresholds_txt, "w") as f:
-    f.write(f"min_max_brightness = {min_max_brightness}\n")
-    f.write(f"max_avg_brightness = {max_avg_brightness}\n")
-    f.write(f"max_s/m_threshold = {max_s_m_threshold}\n")
+    f.write(f"min_max_brightness = {min_max_brightness}\n"
+            f"max_avg_brightness = {max_avg_brightness}\n"
+            f"max_s/m_threshold = {max_s_m_threshold}\n")
 
 print("Done moving/copying files into categories.")
 # %%
@@ -1,16 +1,24 @@
+import functools
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
 
+@functools.lru_cache(maxsize=None)
+def gaussian_spot(kernel_radius, kernel_sigma, peak):
+    """
+    uint8 Gaussian spot, (2*kernel_radius+1) square with value `peak` at the center, built once per
+    parameters. The 1-D kernel is normalized before the outer product (max(c c^T) = max(c)^2).
+    """
+    kernel_size = 2*kernel_radius + 1
+    c = cv2.getGaussianKernel(kernel_size, kernel_sigma)
+    c = c / np.max(c)
+    return (peak * c.dot(c.T)).astype(np.uint8)
+
 kernel_radius = 16
 kernel_sigma = 7
 peak = 255
-kernel_size = 2*kernel_radius + 1
-c = cv2.getGaussianKernel(kernel_size,kernel_sigma)
-cc = c.dot(c.T)
-ccc = cc / np.max(cc)
-cccc = peak * ccc
-# print(ccc)
+spot_kernel = gaussian_spot(kernel_radius, kernel_sigma, peak)
+# print(spot_kernel)
 
 h, w = 512, 1024
 img = np.full((h, w, 3), fill_value=8, dtype=np.uint8)
@@ -28,13 +36,12 @@ y0, y1 = max(0, y-half), min(h, y+half+1)
 kx0, kx1 = half - (x - x0), half + (x1 - x)
 ky0, ky1 = half - (y - y0), half + (y1 - y)
 
-# add (with clipping) to all three channels
-spot = cccc[ky0:ky1, kx0:kx1].astype(np.uint8)
-for c in range(3):
-    img[y0:y1, x0:x1, c] = np.clip(
-        img[y0:y1, x0:x1, c].astype(int) + spot.astype(int),
-        0, 255
-    ).astype(np.uint8)
+# saturating uint8 add to all three channels at once, in place
+# (min(roi, 255 - spot) + spot never overflows)
+spot = spot_kernel[ky0:ky1, kx0:kx1, np.newaxis]
+roi = img[y0:y1, x0:x1]
+np.minimum(roi, 255 - spot, out=roi)
+roi += spot
 
 
 